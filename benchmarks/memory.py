@@ -0,0 +1,146 @@
+"""
+Memory harness, measured with tracemalloc:
+	bytes retained per parsed Update, by kind
+	peak memory of multipart form body, by file size
+	memory growth over a long Pooling run
+
+	python -m benchmarks.memory [--json]
+"""
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from time import sleep
+from typing import Dict, List
+
+from benchmarks.samples import KINDS, make_update
+from telegram_bot_api import API, InputFile, Pooling, Update
+from telegram_bot_api.replay import ReplayAPI, synthetic_records
+
+FILE_SIZES = (64 << 10, 1 << 20, 16 << 20)
+
+
+class _NullConnection:
+	"""Takes form body instead of a socket, reads files by blocks like http.client does."""
+
+	def __init__(self):
+		self.sent: int = 0
+
+	def send(self, data):
+		if hasattr(data, "read"):
+			for block in iter(lambda: data.read(8192), b""):
+				self.sent += len(block)
+			return
+		self.sent += len(data)
+
+
+@contextmanager
+def _traced():
+	gc.collect()
+	tracemalloc.start()
+	try:
+		yield
+	finally:
+		tracemalloc.stop()
+
+
+def update_bytes(kind: str, count: int = 2000) -> float:
+	"""Bytes retained per parsed Update of `kind`."""
+	payloads = [make_update(kind, i) for i in range(count)]
+	with _traced():
+		before = tracemalloc.get_traced_memory()[0]
+		updates = [Update(**d) for d in payloads]
+		gc.collect()
+		retained = tracemalloc.get_traced_memory()[0] - before
+	del updates
+	return retained / count
+
+
+def _send_form(value):
+	form = API._MultiPartForm()
+	form.write_params({"chat_id": 1, "caption": "benchmark"})
+	form.write_one_input(InputFile(value, file_name="file.bin"), "document")
+	form.finish()
+	conn = _NullConnection()
+	form.send_body(conn)
+	assert conn.sent == form.size
+
+
+def multipart_peak(file_size: int) -> Dict[str, int]:
+	"""Peak bytes allocated while multipart body with a file of `file_size` is built and sent."""
+	result = {}
+	# mimetypes database is loaded by the first form
+	_send_form(b"")
+	with tempfile.NamedTemporaryFile(delete=False) as f:
+		f.write(os.urandom(file_size))
+	try:
+		for source in ("path", "bytes"):
+			value = f.name if source == "path" else open(f.name, "rb").read()
+			with _traced():
+				_send_form(value)
+				result[source] = tracemalloc.get_traced_memory()[1]
+			del value
+	finally:
+		os.remove(f.name)
+	return result
+
+
+def replay_growth(count: int = 20000) -> Dict[str, float]:
+	"""Traced memory after every quarter of a long Pooling run, growth means updates are kept somewhere."""
+	api = ReplayAPI(synthetic_records(count, seed=1), speed=None)
+	samples = []
+
+	def handler(update: Update):
+		api.arrived.pop(update.update_id, None)
+		if update.update_id % (count // 4) == 0:
+			gc.collect()
+			samples.append(tracemalloc.get_traced_memory()[0])
+
+	with _traced():
+		before = tracemalloc.get_traced_memory()[0]
+		pooling = Pooling(api, handler, update_time=0.001, prefetch=2).start()
+		while not api.exhausted or pooling.in_flight:
+			sleep(0.01)
+		pooling.stop()
+		gc.collect()
+		retained = tracemalloc.get_traced_memory()[0] - before
+	return {
+		"updates": count,
+		"retained": retained,
+		"first_quarter": samples[0] if samples else 0,
+		"growth_per_1k": (samples[-1] - samples[0]) / (count * 3 / 4) * 1000 if len(samples) > 1 else 0,
+	}
+
+
+def run() -> Dict[str, dict]:
+	return {
+		"update_bytes": {kind: update_bytes(kind) for kind in KINDS},
+		"multipart_peak": {str(size): multipart_peak(size) for size in FILE_SIZES},
+		"replay": replay_growth(),
+	}
+
+
+def main(argv: List[str]):
+	results = run()
+	if "--json" in argv:
+		print(json.dumps(results, indent=2))
+		return
+
+	print("bytes per parsed Update")
+	for kind, size in results["update_bytes"].items():
+		print(f'  {kind:<16}{size:>10.0f}')
+	print("multipart peak bytes, file sent from path / bytes")
+	for size, peak in results["multipart_peak"].items():
+		print(f'  {int(size) >> 10:>8} KiB{peak["path"]:>12}{peak["bytes"]:>12}')
+	replay = results["replay"]
+	print(
+		f'replay of {replay["updates"]} updates: {replay["growth_per_1k"]:.0f} bytes growth per 1000 updates, '
+		f'{replay["retained"]} bytes retained after stop'
+	)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
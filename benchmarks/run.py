@@ -0,0 +1,232 @@
+"""
+Benchmark runner. Every benchmark is run `repeat` times, median and interquartile range are compared
+with the baseline of the running Python version stored in benchmarks/baselines.
+
+	python -m benchmarks.run            compare with baseline, exit code 1 on regression
+	python -m benchmarks.run --save     store results as the new baseline
+	python -m benchmarks.run --memory   measure memory too, see benchmarks.memory
+
+Regression is a median slower than baseline by more than --threshold (0.1 is 10%), when interquartile
+ranges of both runs do not overlap as well, so noisy results do not fail the gate.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.samples import make_updates
+from telegram_bot_api import (
+	API, InputFile, Update, MessageEntityType, InlineKeyboardMarkup, InlineKeyboardButton,
+	InlineQueryResultArticle, InputTextMessageContent, get_entities_by_type,
+)
+from telegram_bot_api.api import _dumps
+from telegram_bot_api.replay import Replayer, synthetic_records
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines")
+
+# bytes of noise allowed above baseline
+_MEMORY_SLACK = {
+	"memory.replay.retained": 256 << 10,
+	"memory.replay.first_quarter": 256 << 10,
+}
+
+
+class _NullConnection:
+	def send(self, data):
+		pass
+
+
+def bench_parse_updates() -> Callable[[], None]:
+	payloads = make_updates(600)
+
+	def run():
+		for d in payloads:
+			Update(**d)
+
+	return run
+
+
+def bench_dumps() -> Callable[[], None]:
+	markup = InlineKeyboardMarkup(inline_keyboard=[
+		[InlineKeyboardButton(text=f'button {i}{j}', callback_data=f'{i}:{j}') for j in range(4)] for i in range(5)
+	])
+	results = [
+		InlineQueryResultArticle(
+			id_=str(i), title=f'result {i}', input_message_content=InputTextMessageContent(f'text {i}')
+		) for i in range(50)
+	]
+
+	def run():
+		for _ in range(100):
+			_dumps(markup)
+		for _ in range(5):
+			_dumps(results)
+
+	return run
+
+
+def bench_multipart() -> Callable[[], None]:
+	data = os.urandom(64 << 10)
+
+	def run():
+		for _ in range(200):
+			form = API._MultiPartForm()
+			form.write_params({"chat_id": 1, "caption": "benchmark", "reply_markup": {"remove_keyboard": True}})
+			form.write_one_input(InputFile(data, file_name="file.bin"), "document")
+			form.finish()
+			form.send_body(_NullConnection())
+
+	return run
+
+
+def bench_get_entities() -> Callable[[], None]:
+	messages = [Update(**d).message for d in make_updates(2000, kinds=("text",))]
+
+	def run():
+		for message in messages:
+			for entity_type in (MessageEntityType.BOT_COMMAND, MessageEntityType.URL, MessageEntityType.HASHTAG):
+				get_entities_by_type(message, entity_type)
+
+	return run
+
+
+def bench_replay() -> Callable[[], None]:
+	def run():
+		Replayer(synthetic_records(500, seed=1), speed=None).run(lambda update: None, prefetch=2)
+
+	return run
+
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], None]]] = {
+	"parse_updates": bench_parse_updates,
+	"dumps": bench_dumps,
+	"multipart": bench_multipart,
+	"get_entities": bench_get_entities,
+	"replay": bench_replay,
+}
+
+
+def _quartiles(values: List[float]) -> Tuple[float, float, float]:
+	ordered = sorted(values)
+
+	def at(q: float) -> float:
+		position = q * (len(ordered) - 1)
+		low = int(position)
+		high = min(low + 1, len(ordered) - 1)
+		return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+	return at(0.25), at(0.5), at(0.75)
+
+
+def measure(make: Callable[[], Callable[[], None]], repeat: int) -> Dict[str, float]:
+	"""Seconds per run: median and IQR of `repeat` runs after one warm up run."""
+	run = make()
+	run()
+	times = []
+	gc_enabled = gc.isenabled()
+	gc.disable()
+	try:
+		for _ in range(repeat):
+			started = perf_counter()
+			run()
+			times.append(perf_counter() - started)
+	finally:
+		if gc_enabled:
+			gc.enable()
+	q1, median, q3 = _quartiles(times)
+	return {"median": median, "q1": q1, "q3": q3}
+
+
+def baseline_path() -> str:
+	return os.path.join(BASELINES, f'py{sys.version_info[0]}.{sys.version_info[1]}.json')
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> List[str]:
+	"""Returns names of regressed benchmarks and prints the diff."""
+	regressed = []
+	print(f'{"benchmark":<34}{"baseline":>12}{"now":>12}{"change":>10}')
+	for name, now in results.items():
+		base = baseline.get(name)
+		if base is None:
+			print(f'{name:<34}{"-":>12}{now["median"]:>12.6g}{"new":>10}')
+			continue
+		change = now["median"] / base["median"] - 1 if base["median"] else 0.0
+		# interquartile ranges do not overlap: most of the new runs are slower than most of baseline runs
+		slower = change > threshold and now["q1"] > base["q3"]
+		mark = "  REGRESSED" if slower else ""
+		print(f'{name:<34}{base["median"]:>12.6g}{now["median"]:>12.6g}{change:>+10.1%}{mark}')
+		if slower:
+			regressed.append(name)
+	return regressed
+
+
+def _memory_results() -> Dict[str, Dict[str, float]]:
+	from benchmarks import memory
+	results = memory.run()
+	flat = {}
+	for kind, size in results["update_bytes"].items():
+		flat[f'memory.update.{kind}'] = size
+	for file_size, peak in results["multipart_peak"].items():
+		for source, size in peak.items():
+			flat[f'memory.multipart.{file_size}.{source}'] = size
+	# growth_per_1k swings around zero, so leaks are caught by memory left after the run instead
+	for name in ("retained", "first_quarter"):
+		flat[f'memory.replay.{name}'] = results["replay"][name]
+	# memory is deterministic enough to be compared without spread, except the replay which samples
+	# while batches are in flight: it gets an allowance, leaking updates grows it by megabytes
+	return {
+		name: {"median": value, "q1": value, "q3": value + _MEMORY_SLACK.get(name, 0)} for name, value in flat.items()
+	}
+
+
+def main(argv: List[str]) -> int:
+	parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+	parser.add_argument("--save", action="store_true", help="store results as baseline")
+	parser.add_argument("--repeat", type=int, default=21)
+	parser.add_argument("--threshold", type=float, default=0.1)
+	parser.add_argument("--memory", action="store_true", help="include benchmarks.memory results")
+	parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="run only these benchmarks")
+	args = parser.parse_args(argv)
+
+	results = {}
+	for name, make in BENCHMARKS.items():
+		if args.only and name not in args.only:
+			continue
+		results[name] = measure(make, args.repeat)
+	if args.memory:
+		results.update(_memory_results())
+
+	path = baseline_path()
+	if args.save:
+		baseline = {}
+		if os.path.exists(path):
+			with open(path, "r") as f:
+				baseline = json.load(f)["results"]
+		baseline.update(results)
+		os.makedirs(BASELINES, exist_ok=True)
+		with open(path, "w") as f:
+			json.dump({"python": platform.python_version(), "results": baseline}, f, indent=2, sort_keys=True)
+		print(f'baseline saved to {path}')
+		return 0
+
+	if not os.path.exists(path):
+		for name, now in results.items():
+			print(f'{name:<34}{now["median"]:>12.6g}  IQR {now["q1"]:.6g}..{now["q3"]:.6g}')
+		print(f'no baseline for this Python version, run with --save to create {path}')
+		return 0
+
+	with open(path, "r") as f:
+		baseline = json.load(f)["results"]
+	regressed = compare(baseline, results, args.threshold)
+	if regressed:
+		print(f'regressed: {", ".join(regressed)}')
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
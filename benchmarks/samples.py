@@ -0,0 +1,10 @@
+from typing import List
+
+from telegram_bot_api.replay import SYNTHETIC_MIX, synthetic_update as make_update
+
+# update kinds produced by make_update()
+KINDS = tuple(SYNTHETIC_MIX)
+
+
+def make_updates(count: int, kinds=KINDS, first_id: int = 1) -> List[dict]:
+	return [make_update(kinds[i % len(kinds)], first_id + i) for i in range(count)]
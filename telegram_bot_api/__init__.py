@@ -1,4 +1,14 @@
 from .api import *
 from .pooling import *
 from .utils import *
-
+from .timer import *
+from .dispatch import *
+from .scheduler import *
+from .broadcast import *
+from .coalesce import *
+from .chat_action import *
+from .upload_cache import *
+from .cache import *
+from .file_cache import *
+from .metrics import *
+from .profiling import *
@@ -3,11 +3,16 @@ import http.client
 import json
 import mimetypes
 import os
-import stat
+import socket as _socket
+import threading as _threading
+from concurrent.futures import Future as _Future, ThreadPoolExecutor as _ThreadPoolExecutor, wait as _wait
 from enum import Enum
+from functools import partial as _partial
 from io import BytesIO
-from typing import List, Optional, Tuple, Any, Union
+from time import monotonic as _monotonic
+from typing import List, Optional, Tuple, Any, Union, BinaryIO, Iterable, Callable, Dict, Set
 from urllib.parse import urlencode
+from weakref import WeakValueDictionary as _WeakValueDictionary
 
 
 def _make_optional(params: dict, *exclude):
@@ -42,6 +47,16 @@ def __ser(obj):
 	return obj
 
 
+def _find_file_id(result, field: str) -> Optional[str]:
+	# file sent as `field` is in the same field of resulting Message, photo is a list of sizes
+	if not isinstance(result, dict):
+		return None
+	value = result.get(field, result)
+	if isinstance(value, list):
+		value = value[-1] if value else None
+	return value.get("file_id") if isinstance(value, dict) else None
+
+
 def _dumps(obj):
 	o = __ser(obj)
 	if isinstance(o, list):
@@ -51,6 +66,28 @@ def _dumps(obj):
 	return obj
 
 
+class ApiError(ValueError):
+	"""https://core.telegram.org/bots/api#making-requests"""
+
+	def __init__(self, message: str, data: bytes, code: int = 0):
+		ValueError.__init__(self, message, data)
+		self.code: int = code
+		self.description: str = ""
+		self.retry_after: Optional[int] = None
+		self.migrate_to_chat_id: Optional[int] = None
+		try:
+			parsed = json.loads(data)
+		except ValueError:
+			return
+		if not isinstance(parsed, dict):
+			return
+		self.code = parsed.get("error_code", code)
+		self.description = parsed.get("description", "")
+		parameters = parsed.get("parameters") or {}
+		self.retry_after = parameters.get("retry_after")
+		self.migrate_to_chat_id = parameters.get("migrate_to_chat_id")
+
+
 class MessageEntityType(Enum):
 	"""https://core.telegram.org/bots/api#messageentity"""
 	MENTION = "mention"
@@ -176,14 +213,53 @@ class _FileDescription:
 
 
 class InputFile:
-	"""https://core.telegram.org/bots/api#inputfile"""
+	"""https://core.telegram.org/bots/api#inputfile
+	path: path to a file, or file content: bytes, memoryview, binary file object or iterable of bytes chunks.
+	Content is sent as is, without copies. file_name is required for content,
+	size is required for chunks and non-seekable streams like pipes or HTTP responses (otherwise they are read into memory).
+	"""
 
-	def __init__(self, path: str):
-		self.value: str = path
+	def __init__(
+			self,
+			path: Union[str, bytes, memoryview, BinaryIO, Iterable[bytes]],
+			file_name: Optional[str] = None,
+			size: Optional[int] = None
+	):
+		assert isinstance(path, str) or file_name, "file_name is required for file content"
+		self.value: Union[str, bytes, memoryview, BinaryIO, Iterable[bytes]] = path
+		self.size: Optional[int] = size
+		self.__file_name: Optional[str] = file_name
 
 	@property
 	def file_name(self) -> str:
-		return self.value.split('/')[-1]
+		return self.__file_name or self.value.split('/')[-1]
+
+	def get_size(self) -> Optional[int]:
+		"""Number of bytes to send, None for chunks and non-seekable streams without size."""
+		value = self.value
+		if self.size is not None:
+			return self.size
+		if isinstance(value, str):
+			return os.path.getsize(value)
+		if isinstance(value, (bytes, bytearray)):
+			return len(value)
+		if isinstance(value, memoryview):
+			return value.nbytes
+		if hasattr(value, "seekable") and value.seekable():
+			position = value.tell()
+			return value.seek(0, os.SEEK_END) - value.seek(position)
+		return None
+
+	def send(self, conn: http.client.HTTPConnection):
+		value = self.value
+		if isinstance(value, str):
+			with open(value, mode="rb") as file:
+				conn.send(file)
+		elif isinstance(value, (bytes, bytearray, memoryview)) or hasattr(value, "read"):
+			conn.send(value)
+		else:
+			for chunk in value:
+				conn.send(chunk)
 
 
 class InputMedia(_Serializable, _Caption):
@@ -1559,19 +1635,98 @@ _FIELDS = {
 
 Keyboards = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, ForceReply]
 
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+# calls which change what API(cache=...) keeps, bots get no updates about their own actions
+_MEMBER_CHANGES = {
+	"kickChatMember", "unbanChatMember", "restrictChatMember", "promoteChatMember", "setChatAdministratorCustomTitle",
+}
+_CHAT_CHANGES = {
+	"setChatPermissions", "setChatPhoto", "deleteChatPhoto", "setChatTitle", "setChatDescription", "pinChatMessage",
+	"unpinChatMessage", "unpinAllChatMessages", "leaveChat", "setChatStickerSet", "deleteChatStickerSet",
+}
+
+
+class ApiCall:
+	"""One API call seen by hooks. `tags` is free for hooks to keep their data between callbacks."""
+
+	def __init__(self, api_method: str, params: dict, size: int):
+		self.api_method: str = api_method
+		# parameters before encoding, files are InputFile
+		self.params: dict = params
+		self.size: int = size
+		self.attempt: int = 0
+		self.tags: dict = {}
+
+
+class ApiHook:
+	"""
+	Base class for API(hooks=[...]). Hooks are called in order for every call: simple, multipart and download.
+	Responses are raw bytes: Bot API JSON or file content for downloadFile.
+	"""
+
+	def before_request(self, call: ApiCall) -> Optional[bytes]:
+		"""Returns response to skip the request, for example served from cache."""
+		return None
+
+	def after_response(self, call: ApiCall, data: bytes) -> bytes:
+		return data
+
+	def on_error(self, call: ApiCall, error: Exception) -> bool:
+		"""Returns True to retry the call, call.attempt counts retries."""
+		return False
+
+
+class ApiBatch:
+	"""Runs API calls in parallel, see API.batch(). Exiting `with` block waits for all calls."""
+
+	def __init__(self, api: "API"):
+		self.__api: API = api
+		self.futures: List[_Future] = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		_wait(self.futures)
+
+	def __getattr__(self, name: str):
+		if name.startswith("_"):
+			raise AttributeError(name)
+		return _partial(self.submit, name)
+
+	def submit(self, method: Union[str, Callable], *args, **kwargs) -> _Future:
+		future = self.__api.submit(method, *args, **kwargs)
+		self.futures.append(future)
+		return future
+
+	def results(self, timeout: Optional[float] = None) -> list:
+		"""Waits for all calls, returns their results in order. Raises the first error."""
+		return [f.result(timeout) for f in self.futures]
+
 
 # https://core.telegram.org/bots/api
 class API:
 	class _MultiPartForm:
-		def __init__(self):
+		def __init__(self, upload_cache=None):
 			self.boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
 			self.buff = BytesIO()
+			# body is a list of encoded form fields and files which are sent directly from the source
+			self.parts: List[Union[bytes, InputFile]] = []
+			self.size: int = 0
+			self.upload_cache = upload_cache
+			# (field, file) uploaded with this form, and (field, file, file_id) taken from cache instead of upload
+			self.uploads: List[Tuple[str, InputFile]] = []
+			self.cached: List[Tuple[str, InputFile, str]] = []
+			# what was written, for hooks
+			self.params: dict = {}
 
 		def write_params(self, params):
 			for key, value in params.items():
 				self.write_one_param(key, value)
 
 		def write_one_param(self, key, value):
+			self.params[key] = value
 			value = _dumps(value)
 			self._write_str(f'--{self.boundary}\r\n')
 			self._write_str(f'Content-Disposition: form-data; name="{key}"\r\n')
@@ -1581,62 +1736,156 @@ class API:
 				value = ""
 			self._write_str(f'{value}\r\n')
 
-		def write_one_input(self, input_file: Union[InputFile, str], field: str):
+		def write_one_input(self, input_file: Union[InputFile, str], field: str, cacheable: bool = True):
+			"""cacheable: False for fields which accept new uploads only, like thumb or setChatPhoto photo"""
 			if isinstance(input_file, str):
 				self.write_params({field: input_file})
-			else:
-				self.write_file(input_file, field)
+				return
+			if self.upload_cache and cacheable:
+				file_id = self.upload_cache.lookup(input_file, field)
+				if file_id:
+					self.cached.append((field, input_file, file_id))
+					self.write_params({field: file_id})
+					return
+				self.uploads.append((field, input_file))
+			self.write_file(input_file, field)
+
+		def on_result(self, result):
+			# remember file_ids of uploaded files, so they are not uploaded again
+			for field, input_file in self.uploads:
+				file_id = _find_file_id(result, field)
+				if file_id:
+					self.upload_cache.store(input_file, field, file_id)
+
+		def on_error(self):
+			# cached file_id could be rejected, upload the file next time
+			for _, _, file_id in self.cached:
+				self.upload_cache.forget(file_id)
+
+		def without_cache(self) -> "API._MultiPartForm":
+			"""The same form with cached files uploaded again."""
+			form = API._MultiPartForm(self.upload_cache)
+			cached = {field: input_file for field, input_file, _ in self.cached}
+			form.uploads = self.uploads + list(cached.items())
+			for key, value in self.params.items():
+				value = cached.get(key, value)
+				if isinstance(value, InputFile):
+					form.write_file(value, key)
+				else:
+					form.write_one_param(key, value)
+			form.finish()
+			return form
 
 		def write_file(self, input_file: InputFile, field: str = None):
 			boundary = self.boundary
 
-			path = input_file.value
 			file_name = input_file.file_name
 			field = field or file_name
-			with open(path, mode="rb") as file:
-				file_size = os.fstat(file.fileno())[stat.ST_SIZE]
-				content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
-
-				self._write_str(f'--{boundary}\r\n')
-				self._write_str(f'Content-Disposition: form-data; name="{field}"; filename="{file_name}"\r\n')
-				self._write_str(f'Content-Type: {content_type}; charset=utf-8\r\n')
-				self._write_str(f'Content-Length: {file_size}\r\n')
-
-				file.seek(0)
-				self.buff.write(b'\r\n')
-				self.buff.write(file.read())
-				self.buff.write(b'\r\n')
+			self.params[field] = input_file
+			file_size = input_file.get_size()
+			if file_size is None:
+				value = input_file.value
+				content = value.read() if hasattr(value, "read") else b"".join(value)
+				input_file = InputFile(content, file_name)
+				file_size = input_file.get_size()
+			content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+
+			self._write_str(f'--{boundary}\r\n')
+			self._write_str(f'Content-Disposition: form-data; name="{field}"; filename="{file_name}"\r\n')
+			self._write_str(f'Content-Type: {content_type}; charset=utf-8\r\n')
+			self._write_str(f'Content-Length: {file_size}\r\n')
+			self.buff.write(b'\r\n')
+
+			self._flush_buff()
+			self.parts.append(input_file)
+			self.size += file_size
+			self.buff.write(b'\r\n')
 
 		def _write_str(self, value: str):
 			self.buff.write(value.encode('utf-8'))
 
-		def get_data(self):
+		def _flush_buff(self):
+			data = self.buff.getvalue()
+			if data:
+				self.parts.append(data)
+				self.size += len(data)
+			self.buff = BytesIO()
+
+		def finish(self):
 			self._write_str(f'--{self.boundary}--\r\n')
-			return self.boundary, self.buff.getvalue()
+			self._flush_buff()
 
-		def make_request(self, host, url):
-			boundary, buffer = self.get_data()
-			buffer_size = len(buffer)
+		@property
+		def replayable(self) -> bool:
+			# file objects and chunks can be sent only once
+			return all(
+				isinstance(p.value, (str, bytes, bytearray, memoryview)) for p in self.parts if isinstance(p, InputFile)
+			)
 
-			conn = http.client.HTTPSConnection(host)
-			conn.connect()
+		def make_request(self, conn, url):
 			conn.putrequest("POST", url)
 			conn.putheader('Connection', 'Keep-Alive')
 			conn.putheader('Cache-Control', 'no-cache')
 			conn.putheader('Accept', 'application/json')
-			conn.putheader('Content-type', f'multipart/form-data; boundary={boundary}')
-			conn.putheader('Content-length', str(buffer_size))
+			conn.putheader('Content-type', f'multipart/form-data; boundary={self.boundary}')
+			conn.putheader('Content-length', str(self.size))
 			conn.endheaders()
 
-			conn.send(buffer)
+			self.send_body(conn)
 
 			return conn.getresponse()
 
-	def __init__(self, token: str, host: str = "api.telegram.org"):
-		"""https://core.telegram.org/bots/api"""
+		def send_body(self, conn):
+			for part in self.parts:
+				if isinstance(part, InputFile):
+					part.send(conn)
+				else:
+					conn.send(part)
+
+	def __init__(
+			self,
+			token: str,
+			host: str = "api.telegram.org",
+			timeout: Optional[float] = None,
+			scheduler: Optional[Any] = None,
+			upload_cache: Optional[Any] = None,
+			max_workers: int = 8,
+			cache: Optional[Any] = None,
+			metrics: Optional[Any] = None,
+			hooks: Iterable[ApiHook] = (),
+			secure: bool = True
+	):
+		"""https://core.telegram.org/bots/api
+		timeout: socket timeout in seconds, must be longer than getUpdates long polling timeout
+		scheduler: RequestScheduler, orders calls by priority when rate limit is reached
+		upload_cache: UploadCache, sends file_id instead of uploading the same file again
+		max_workers: number of threads for submit() and batch()
+		cache: MetadataCache, keeps results of getChat, getChatMember and other rarely changing calls
+		metrics: ApiMetrics, counts calls, latency and bytes per method
+		hooks: ApiHook list, see add_hook()
+		secure: False for plain HTTP, for local servers like FakeBotApi
+		"""
 
 		self.__host: str = host
+		self.__scheme: str = "https" if secure else "http"
+		self.__connection_class = http.client.HTTPSConnection if secure else http.client.HTTPConnection
 		self.__token: str = token
+		self.__timeout: Optional[float] = timeout
+		self.__scheduler = scheduler
+		self.__upload_cache = upload_cache
+		self.__local = _threading.local()
+		# thread ident -> its keep-alive connection, and threads whose request was interrupted
+		self.__connections: _WeakValueDictionary = _WeakValueDictionary()
+		self.__interrupted: Set[int] = set()
+		self.__max_workers: int = max_workers
+		self.__executor: Optional[_ThreadPoolExecutor] = None
+		self.__executor_lock = _threading.Lock()
+		self.__cache = cache
+		self.__metrics = metrics
+		self.__hooks: Tuple[ApiHook, ...] = ()
+		self.__request = self.__call
+		for hook in hooks:
+			self.add_hook(hook)
 
 	# https://core.telegram.org/bots/api#getupdates
 	def get_updates(self, offset=None, limit=None, timeout=None, allowed_updates=None) -> List[Update]:
@@ -1653,7 +1902,7 @@ class API:
 			drop_pending_updates: Optional[bool] = None
 	) -> bool:
 		params = _make_optional(locals(), self, certificate)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		if certificate:
 			form.write_file(certificate, "certificate")
@@ -1672,7 +1921,7 @@ class API:
 
 	# https://core.telegram.org/bots/api#getme
 	def get_me(self) -> User:
-		return User(**self.__simple("getMe", {}))
+		return self.__cached("getMe", (), lambda: User(**self.__simple("getMe", {})))
 
 	# https://core.telegram.org/bots/api#logout
 	def log_out(self) -> bool:
@@ -1739,7 +1988,7 @@ class API:
 
 	):
 		params = _make_optional(locals(), self, photo)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(photo, "photo")
 
@@ -1760,11 +2009,11 @@ class API:
 			thumb: Optional[Union[InputFile, str]] = None
 	):
 		params = _make_optional(locals(), self, audio, thumb)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(audio, "audio")
 		if thumb:
-			form.write_one_input(thumb, "thumb")
+			form.write_one_input(thumb, "thumb", cacheable=False)
 
 		data = self.__make_multipart_request(form, "sendAudio")
 		return Message(**data.get("result", None))
@@ -1787,11 +2036,11 @@ class API:
 	):
 		params = _make_optional(locals(), self, document, thumb)
 
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(document, "document")
 		if thumb:
-			form.write_one_input(thumb, "thumb")
+			form.write_one_input(thumb, "thumb", cacheable=False)
 
 		data = self.__make_multipart_request(form, "sendDocument")
 		return Message(**data.get("result", None))
@@ -1817,11 +2066,11 @@ class API:
 			reply_markup: Optional[Keyboards] = None
 	):
 		params = _make_optional(locals(), self, video, thumb)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(video, "video")
 		if thumb:
-			form.write_one_input(thumb, "thumb")
+			form.write_one_input(thumb, "thumb", cacheable=False)
 
 		data = self.__make_multipart_request(form, "sendVideo")
 		return Message(**data.get("result", None))
@@ -1846,11 +2095,11 @@ class API:
 			reply_markup: Optional[Keyboards] = None
 	):
 		params = _make_optional(locals(), self, animation, thumb)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(animation, "animation")
 		if thumb:
-			form.write_one_input(thumb, "thumb")
+			form.write_one_input(thumb, "thumb", cacheable=False)
 
 		data = self.__make_multipart_request(form, "sendAnimation")
 		return Message(**data.get("result", None))
@@ -1873,7 +2122,7 @@ class API:
 			reply_markup: Optional[Keyboards] = None
 	):
 		params = _make_optional(locals(), self, voice)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(voice, "voice")
 
@@ -1901,11 +2150,11 @@ class API:
 			reply_markup: Optional[Keyboards] = None
 	):
 		params = _make_optional(locals(), self, video_note, thumb)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(video_note, "video_note")
 		if thumb:
-			form.write_one_input(thumb, "thumb")
+			form.write_one_input(thumb, "thumb", cacheable=False)
 
 		data = self.__make_multipart_request(form, "sendVideoNote")
 		return Message(**data.get("result", None))
@@ -1920,7 +2169,7 @@ class API:
 			allow_sending_without_reply: bool = None
 	) -> List[Message]:
 		params = _make_optional(locals(), self)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		for m in media:
 			if isinstance(m.media, str):
 				continue
@@ -2075,6 +2324,17 @@ class API:
 	def get_file(self, file_id: str) -> File:
 		return File(**self.__simple("getFile", {"file_id": file_id}))
 
+	# https://core.telegram.org/bots/api#getfile
+	def download_file(self, file_path: str) -> bytes:
+		"""Downloads file by File.file_path, see get_file()"""
+		url = f'{self.__scheme}://{self.__host}/file/bot{self.__token}/{file_path}'
+
+		def send(conn):
+			conn.request("GET", url)
+			return conn.getresponse()
+
+		return self.__request("downloadFile", send, params={"file_path": file_path})
+
 	# https://core.telegram.org/bots/api#kickchatmember
 	def kick_chat_member(self, chat_id: Union[int, str], user_id: int, until_date: Optional[int] = None) -> bool:
 		return bool(self.__simple("kickChatMember", locals()))
@@ -2137,9 +2397,9 @@ class API:
 			chat_id: Union[int, str],
 			photo: InputFile,
 	) -> bool:
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params({"chat_id": chat_id})
-		form.write_one_input(photo, "photo")
+		form.write_one_input(photo, "photo", cacheable=False)
 
 		data = self.__make_multipart_request(form, "setChatPhoto")
 		return bool(data.get("result"))
@@ -2179,11 +2439,13 @@ class API:
 
 	# https://core.telegram.org/bots/api#getchat
 	def get_chat(self, chat_id: Union[int, str]) -> Chat:
-		return Chat(**self.__simple("getChat", {"chat_id": chat_id}))
+		return self.__cached("getChat", (chat_id,), lambda: Chat(**self.__simple("getChat", {"chat_id": chat_id})))
 
 	# https://core.telegram.org/bots/api#getchatadministrators
 	def get_chat_administrators(self, chat_id: Union[int, str]) -> List[ChatMember]:
-		return [ChatMember(**d) for d in self.__simple("getChatAdministrators", {"chat_id": chat_id})]
+		return self.__cached("getChatAdministrators", (chat_id,), lambda: [
+			ChatMember(**d) for d in self.__simple("getChatAdministrators", {"chat_id": chat_id})
+		])
 
 	# https://core.telegram.org/bots/api#getchatmemberscount
 	def get_chat_members_count(self, chat_id: Union[int, str]) -> int:
@@ -2191,7 +2453,9 @@ class API:
 
 	# https://core.telegram.org/bots/api#getchatmemberscount
 	def get_chat_member(self, chat_id: Union[int, str], user_id: int) -> ChatMember:
-		return ChatMember(**self.__simple("getChatMember", {"chat_id": chat_id, "user_id": user_id}))
+		return self.__cached("getChatMember", (chat_id, user_id), lambda: ChatMember(
+			**self.__simple("getChatMember", {"chat_id": chat_id, "user_id": user_id})
+		))
 
 	# https://core.telegram.org/bots/api#setchatstickerset
 	def set_chat_sticker_set(self, chat_id: Union[int, str], sticker_set_name: str) -> bool:
@@ -2220,8 +2484,9 @@ class API:
 
 	# https://core.telegram.org/bots/api#getmycommands
 	def get_my_commands(self) -> List[BotCommand]:
-		data = self.__make_request("getMyCommands", {})
-		return [BotCommand(**c) for c in data.get("result")]
+		return self.__cached("getMyCommands", (), lambda: [
+			BotCommand(**c) for c in self.__make_request("getMyCommands", {}).get("result")
+		])
 
 	# https://core.telegram.org/bots/api#editmessagetext
 	def edit_message_text(
@@ -2302,7 +2567,7 @@ class API:
 
 	) -> Message:
 		params = _make_optional(locals(), self, sticker)
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		form.write_one_input(sticker, "sticker")
 
@@ -2311,7 +2576,7 @@ class API:
 
 	# https://core.telegram.org/bots/api#getstickerset
 	def get_sticker_set(self, name: str) -> StickerSet:
-		return StickerSet(**self.__simple("getStickerSet", {"name": name}))
+		return self.__cached("getStickerSet", (name,), lambda: StickerSet(**self.__simple("getStickerSet", {"name": name})))
 
 	# https://core.telegram.org/bots/api#uploadstickerfile
 	def upload_sticker_file(
@@ -2319,21 +2584,21 @@ class API:
 			user_id: int,
 			png_sticker: InputFile
 	) -> File:
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params({"user_id": user_id})
-		form.write_one_input(png_sticker, "png_sticker")
+		form.write_one_input(png_sticker, "png_sticker", cacheable=False)
 
 		data = self.__make_multipart_request(form, "uploadStickerFile")
 		return File(**data.get("result"))
 
 	def __stickers(self, method, params, png_sticker, tgs_sticker):
 		assert bool(png_sticker) ^ bool(tgs_sticker), "png_sticker or tgs_sticker must be set"
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params(params)
 		if png_sticker:
 			form.write_one_input(png_sticker, "png_sticker")
 		if tgs_sticker:
-			form.write_one_input(tgs_sticker, "tgs_sticker")
+			form.write_one_input(tgs_sticker, "tgs_sticker", cacheable=False)
 
 		data = self.__make_multipart_request(form, method)
 		return bool(data.get("result"))
@@ -2381,7 +2646,7 @@ class API:
 			user_id: int,
 			thumb: Optional[Union[InputFile, str]]
 	) -> File:
-		form = self._MultiPartForm()
+		form = self._MultiPartForm(self.__upload_cache)
 		form.write_params({"name": name, "user_id": user_id})
 		if thumb:
 			form.write_one_input(thumb, "thumb")
@@ -2393,7 +2658,7 @@ class API:
 	def answer_inline_query(
 			self,
 			inline_query_id: str,
-			results: List[InlineQueryResult],
+			results: Union[List[InlineQueryResult], str],  # or results already encoded to JSON
 			cache_time: Optional[int] = None,
 			is_personal: Optional[bool] = None,
 			next_offset: Optional[str] = None,
@@ -2476,13 +2741,185 @@ class API:
 	) -> List[GameHighScore]:
 		return [GameHighScore(**d) for d in self.__simple("getGameHighScores", locals())]
 
+	def submit(self, method: Union[str, Callable], *args, **kwargs) -> _Future:
+		"""
+		Calls API method (name or bound method) on a thread pool, returns Future with its result.
+		Up to `max_workers` calls run at once, every pool thread keeps its own connection.
+		"""
+		func = getattr(self, method) if isinstance(method, str) else method
+		with self.__executor_lock:
+			if not self.__executor:
+				self.__executor = _ThreadPoolExecutor(max_workers=self.__max_workers, thread_name_prefix="API")
+		return self.__executor.submit(func, *args, **kwargs)
+
+	def batch(self) -> "ApiBatch":
+		"""
+		with api.batch() as batch:
+			reply = batch.send_message(chat_id, "done")
+			member = batch.get_chat_member(chat_id, user_id)
+		print(member.result().status)
+		"""
+		return ApiBatch(self)
+
+	def shutdown(self, wait_calls: bool = True):
+		"""Stops thread pool used by submit()."""
+		with self.__executor_lock:
+			executor, self.__executor = self.__executor, None
+		if executor:
+			executor.shutdown(wait_calls)
+
+	def add_hook(self, hook: ApiHook):
+		"""Hooks see every call: they can time, log, tag, answer calls themselves or retry them."""
+		self.__hooks += (hook,)
+		self.__request = self.__call_hooked
+
+	def remove_hook(self, hook: ApiHook):
+		self.__hooks = tuple(h for h in self.__hooks if h is not hook)
+		if not self.__hooks:
+			# calls go straight to __call again
+			self.__request = self.__call
+
+	def interrupt(self, thread: _threading.Thread) -> bool:
+		"""
+		Breaks the connection of a request running on `thread`, the request raises OSError.
+		If the request is not connected yet, it fails before sending. Used by Pooling.stop() to end
+		getUpdates long polling. Returns False if there was no socket to break.
+		"""
+		self.__interrupted.add(thread.ident)
+		conn = self.__connections.get(thread.ident)
+		sock = conn.sock if conn else None
+		if sock is None:
+			# not connected yet, __send sees the flag before sending
+			return False
+		try:
+			# plain socket shutdown, so SSL state is not touched from this thread
+			_socket.socket.shutdown(sock, _socket.SHUT_RDWR)
+		except OSError:
+			pass
+		return True
+
+	def __cached(self, api_method: str, key: Tuple, load: Callable[[], Any]) -> Any:
+		if self.__cache is None:
+			return load()
+		return self.__cache.get_or_load(api_method, key, load)
+
+	def __invalidate(self, api_method: str, params: dict):
+		if api_method in _MEMBER_CHANGES:
+			self.__cache.invalidate_member(params["chat_id"], params["user_id"])
+		elif api_method in _CHAT_CHANGES:
+			self.__cache.invalidate_chat(params["chat_id"])
+
 	def __get_url(self, api_method) -> str:
-		return f'https://{self.__host}/bot{self.__token}/{api_method}'
+		return f'{self.__scheme}://{self.__host}/bot{self.__token}/{api_method}'
+
+	def __call_hooked(
+			self,
+			api_method: str,
+			send: Callable[[http.client.HTTPConnection], http.client.HTTPResponse],
+			replayable: bool = True,
+			size: int = 0,
+			params: Optional[dict] = None
+	) -> bytes:
+		hooks = self.__hooks
+		call = ApiCall(api_method, params or {}, size)
+		while True:
+			try:
+				for hook in hooks:
+					data = hook.before_request(call)
+					if data is not None:
+						break
+				else:
+					data = self.__call(api_method, send, replayable, size)
+				for hook in hooks:
+					data = hook.after_response(call, data)
+				return data
+			except Exception as ex:
+				retry = [hook.on_error(call, ex) for hook in hooks]
+				if not (replayable and any(retry)):
+					raise
+				call.attempt += 1
+
+	def __call(
+			self,
+			api_method: str,
+			send: Callable[[http.client.HTTPConnection], http.client.HTTPResponse],
+			replayable: bool = True,
+			size: int = 0,
+			params: Optional[dict] = None
+	) -> bytes:
+		if self.__metrics is None:
+			return self.__send(send, replayable)
+
+		started = _monotonic()
+		try:
+			data = self.__send(send, replayable)
+		except ApiError as ex:
+			self.__metrics.observe(api_method, ex.code, _monotonic() - started, size, len(ex.args[1]))
+			raise
+		except Exception:
+			self.__metrics.observe(api_method, 0, _monotonic() - started, size, 0)
+			raise
+		self.__metrics.observe(api_method, 200, _monotonic() - started, size, len(data))
+		return data
+
+	def __send(
+			self,
+			send: Callable[[http.client.HTTPConnection], http.client.HTTPResponse],
+			replayable: bool = True
+	) -> bytes:
+		ident = _threading.get_ident()
+		try:
+			while True:
+				# every thread keeps its own keep-alive connection
+				conn = getattr(self.__local, "conn", None)
+				reused = conn is not None
+				if not reused:
+					conn = self.__local.conn = self.__connection_class(self.__host, timeout=self.__timeout)
+					self.__connections[ident] = conn
+				try:
+					if conn.sock is None:
+						conn.connect()
+					# checked after connect: interrupt() coming later finds the socket and shuts it down
+					if ident in self.__interrupted:
+						raise ConnectionAbortedError("request interrupted")
+					return self.__read_response(send(conn))
+				except (http.client.HTTPException, OSError) as ex:
+					conn.close()
+					self.__local.conn = None
+					self.__connections.pop(ident, None)
+					if ident in self.__interrupted:
+						raise
+					# server closed idle connection, request did not reach it
+					if not (reused and replayable and isinstance(ex, _STALE_CONNECTION_ERRORS)):
+						raise
+		finally:
+			self.__interrupted.discard(ident)
 
 	def __make_multipart_request(self, form, api_method):
+		if self.__scheduler:
+			self.__scheduler.acquire(api_method)
 		url = self.__get_url(api_method)
-		resp = form.make_request(self.__host, url)
-		return self.__process_response(resp)
+		form.finish()
+		send = _partial(form.make_request, url=url)
+		try:
+			data = json.loads(self.__request(api_method, send, form.replayable, form.size, form.params))
+		except ApiError as ex:
+			if not form.cached:
+				raise
+			# cached file_id was rejected, send the files themselves once
+			form.on_error()
+			if ex.code != 400 or not form.replayable:
+				raise
+			form = form.without_cache()
+			if self.__scheduler:
+				self.__scheduler.acquire(api_method)
+			send = _partial(form.make_request, url=url)
+			data = json.loads(self.__request(api_method, send, form.replayable, form.size, form.params))
+		if form.upload_cache:
+			form.on_result(data.get("result"))
+		if self.__cache is not None:
+			self.__invalidate(api_method, form.params)
+		return data
 
 	def __simple(self, method: str, params: dict) -> Union[bool, str, int, dict, list]:
 		params = _make_optional(params, self)
@@ -2490,31 +2927,34 @@ class API:
 		return data.get("result")
 
 	def __make_request(self, api_method: str, params: Optional[dict] = None, method="POST"):
+		if self.__scheduler:
+			self.__scheduler.acquire(api_method)
 
 		url = self.__get_url(api_method)
-		params = {k: _dumps(v) for k, v in params.items()}
-		params = urlencode(params)
+		body = urlencode({k: _dumps(v) for k, v in params.items()})
 
 		headers = {
 			"Content-type": "application/x-www-form-urlencoded",
 			"Accept": "application/json"
 		}
 
-		conn = http.client.HTTPSConnection(self.__host)
-		conn.request(method, url, params, headers)
+		def send(conn):
+			conn.request(method, url, body, headers)
+			return conn.getresponse()
 
-		return self.__process_response(conn.getresponse())
+		data = json.loads(self.__request(api_method, send, size=len(body), params=params))
+		if self.__cache is not None:
+			self.__invalidate(api_method, params)
+		return data
 
 	@staticmethod
-	def __process_response(resp):
+	def __read_response(resp) -> bytes:
 		if resp.reason != "OK":
 			data = resp.read()
-			raise ValueError("unexpected reason", data)
+			raise ApiError("unexpected reason", data, resp.getcode())
 
 		if resp.getcode() != 200:
 			data = resp.read()
-			raise ValueError("unexpected code", data)
+			raise ApiError("unexpected code", data, resp.getcode())
 
-		data = resp.read()
-		parsed_data = json.loads(data)
-		return parsed_data
+		return resp.read()
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+from threading import Thread, Lock, Event
+from time import monotonic, sleep
+from typing import Iterable, Iterator, List, Optional, Set, Tuple, Union, Sized, Callable
+
+from telegram_bot_api import API, ApiError, InputFile
+from telegram_bot_api.scheduler import Priority, request_priority
+
+__all__ = ["BROADCAST_RATE", "RateLimiter", "BroadcastMessage", "BroadcastStats", "Broadcast"]
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+BROADCAST_RATE = 25.0
+
+
+class RateLimiter:
+	"""Spaces calls evenly: no more than `rate` calls per second over all threads."""
+
+	def __init__(self, rate: float):
+		self.__interval: float = 1 / rate
+		self.__next: float = monotonic()
+		self.__lock: Lock = Lock()
+
+	def acquire(self):
+		with self.__lock:
+			now = monotonic()
+			slot = max(now, self.__next)
+			self.__next = slot + self.__interval
+		if slot > now:
+			sleep(slot - now)
+
+	def pause(self, seconds: float):
+		"""Nobody gets a slot for the next `seconds`, used on 429 Too Many Requests."""
+		with self.__lock:
+			self.__next = max(self.__next, monotonic() + seconds)
+
+
+class BroadcastMessage:
+	"""
+	Message to broadcast: API method name and its parameters except chat_id.
+	Files must be sent by file_id or copied with copy_message, so media is never uploaded per chat.
+	"""
+
+	def __init__(self, method: str, **params):
+		assert hasattr(API, method), f'unknown API method {method}'
+		assert not any(isinstance(v, InputFile) for v in params.values()), "upload file once and use file_id"
+		self.method: str = method
+		self.params: dict = params
+
+	@staticmethod
+	def copy(from_chat_id: Union[int, str], message_id: int, **params) -> "BroadcastMessage":
+		return BroadcastMessage("copy_message", from_chat_id=from_chat_id, message_id=message_id, **params)
+
+	@staticmethod
+	def text(text: str, **params) -> "BroadcastMessage":
+		return BroadcastMessage("send_message", text=text, **params)
+
+	@staticmethod
+	def media(kind: str, file_id: str, **params) -> "BroadcastMessage":
+		"""kind is one of: photo, audio, document, video, animation, voice, video_note, sticker"""
+		return BroadcastMessage(f'send_{kind}', **{kind: file_id}, **params)
+
+	def send(self, api: API, chat_id: Union[int, str]):
+		return getattr(api, self.method)(chat_id=chat_id, **self.params)
+
+
+class BroadcastStats:
+	def __init__(self, total: Optional[int]):
+		self.total: Optional[int] = total
+		self.sent: int = 0
+		self.failed: int = 0
+		self.blocked: int = 0
+		self.skipped: int = 0
+		self.started: float = monotonic()
+
+	@property
+	def done(self) -> int:
+		return self.sent + self.failed + self.blocked
+
+	@property
+	def rate(self) -> float:
+		"""Messages per second processed in this run."""
+		elapsed = monotonic() - self.started
+		return self.done / elapsed if elapsed > 0 else 0.0
+
+	@property
+	def eta(self) -> Optional[float]:
+		"""Seconds left, None if total is unknown."""
+		if self.total is None or not self.rate:
+			return None
+		return max(0, self.total - self.skipped - self.done) / self.rate
+
+	def __repr__(self):
+		eta = "?" if self.eta is None else f'{self.eta:.0f}s'
+		return (
+			f'[{self.__class__.__name__}]: sent {self.sent}, blocked {self.blocked}, failed {self.failed}, '
+			f'skipped {self.skipped} of {self.total}, {self.rate:.1f} msg/s, eta {eta}'
+		)
+
+
+class Broadcast:
+	"""
+	Sends one message to many chats with `concurrency` threads, no faster than `rate` messages per second.
+	Progress is saved to `checkpoint` file, so a broadcast restarted with the same chat ids
+	continues where it stopped. Chat ids must come in the same order on every run.
+	Chats which blocked the bot (403) are collected in `blocked`, other failures in `failed`.
+	"""
+
+	def __init__(
+			self,
+			api: API,
+			message: BroadcastMessage,
+			chat_ids: Iterable[Union[int, str]],
+			checkpoint: Optional[str] = None,
+			concurrency: int = 8,
+			rate: float = BROADCAST_RATE,
+			retries: int = 3,
+			checkpoint_interval: float = 5.0,
+			on_blocked: Optional[Callable[[Union[int, str]], None]] = None
+	):
+		self.__api: API = api
+		self.__message: BroadcastMessage = message
+		self.__chat_ids: Iterable[Union[int, str]] = chat_ids
+		self.__checkpoint: Optional[str] = checkpoint
+		self.__concurrency: int = concurrency
+		self.__limiter: RateLimiter = RateLimiter(rate)
+		self.__retries: int = retries
+		self.__checkpoint_interval: float = checkpoint_interval
+		self.__on_blocked: Optional[Callable[[Union[int, str]], None]] = on_blocked
+
+		self.__lock: Lock = Lock()
+		self.__stop_event: Event = Event()
+		self.__source: Optional[Iterator[Tuple[int, Union[int, str]]]] = None
+		# every index below position is done, done holds finished indexes above it
+		self.__position: int = 0
+		self.__done: Set[int] = set()
+		self.__saved_at: float = monotonic()
+
+		self.stats: BroadcastStats = BroadcastStats(len(chat_ids) if isinstance(chat_ids, Sized) else None)
+		self.blocked: List[Union[int, str]] = []
+		self.failed: List[Union[int, str]] = []
+
+	def run(self) -> BroadcastStats:
+		"""Blocks until all chats are processed or stop() is called."""
+		self.__load()
+		self.__source = enumerate(self.__chat_ids)
+		workers = [Thread(target=self.__work, name=f'Broadcast-{i}') for i in range(self.__concurrency)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		with self.__lock:
+			self.__save()
+		logging.info(f'[Broadcast] finished: {self.stats}')
+		return self.stats
+
+	def stop(self):
+		self.__stop_event.set()
+
+	def __next(self) -> Optional[Tuple[int, Union[int, str]]]:
+		with self.__lock:
+			for index, chat_id in self.__source:
+				if index >= self.__position and index not in self.__done:
+					return index, chat_id
+				self.stats.skipped += 1
+		return None
+
+	def __work(self):
+		while not self.__stop_event.is_set():
+			item = self.__next()
+			if item is None:
+				return
+			index, chat_id = item
+			result = self.__send(chat_id)
+			if result is None:
+				# stopped before the message was sent
+				return
+			self.__complete(index, chat_id, result)
+
+	def __send(self, chat_id: Union[int, str]) -> Optional[str]:
+		attempt = 0
+		while not self.__stop_event.is_set():
+			self.__limiter.acquire()
+			try:
+				with request_priority(Priority.BULK):
+					self.__message.send(self.__api, chat_id)
+				return "sent"
+			except ApiError as ex:
+				if ex.code == 403:
+					return "blocked"
+				if ex.code == 429:
+					self.__limiter.pause(ex.retry_after or 1)
+					continue
+				if ex.code == 400:
+					logging.warning(f'[Broadcast] {chat_id}: {ex.description}')
+					return "failed"
+				error = ex
+			except Exception as ex:
+				error = ex
+			attempt += 1
+			if attempt > self.__retries:
+				logging.error(f'[Broadcast] {chat_id}: giving up', exc_info=error)
+				return "failed"
+			self.__stop_event.wait(2 ** attempt)
+		return None
+
+	def __complete(self, index: int, chat_id: Union[int, str], result: str):
+		with self.__lock:
+			if result == "sent":
+				self.stats.sent += 1
+			elif result == "blocked":
+				self.stats.blocked += 1
+				self.blocked.append(chat_id)
+			else:
+				self.stats.failed += 1
+				self.failed.append(chat_id)
+
+			self.__done.add(index)
+			while self.__position in self.__done:
+				self.__done.remove(self.__position)
+				self.__position += 1
+
+			if monotonic() - self.__saved_at >= self.__checkpoint_interval:
+				self.__save()
+				logging.info(f'[Broadcast] {self.stats}')
+
+		if result == "blocked" and self.__on_blocked:
+			self.__on_blocked(chat_id)
+
+	def __load(self):
+		if not self.__checkpoint or not os.path.exists(self.__checkpoint):
+			return
+		with open(self.__checkpoint, "r") as f:
+			data = json.load(f)
+		self.__position = data["position"]
+		self.__done = set(data["done"])
+		self.blocked = data["blocked"]
+		self.failed = data["failed"]
+		logging.info(f'[Broadcast] resumed from {self.__checkpoint} at {self.__position}')
+
+	def __save(self):
+		self.__saved_at = monotonic()
+		if not self.__checkpoint:
+			return
+		data = {
+			"position": self.__position,
+			"done": sorted(self.__done),
+			"blocked": self.blocked,
+			"failed": self.failed,
+		}
+		tmp = f'{self.__checkpoint}.tmp'
+		with open(tmp, "w") as f:
+			json.dump(data, f)
+		os.replace(tmp, self.__checkpoint)
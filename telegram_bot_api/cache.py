@@ -0,0 +1,302 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from itertools import islice
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from telegram_bot_api import API, Chat, Update, Message, InlineQuery, InlineQueryResult
+from telegram_bot_api.api import _dumps
+
+__all__ = ["TTLCache", "METADATA_TTL", "MetadataCache", "INLINE_PAGE_SIZE", "paginate", "InlineQueryCache"]
+
+_MISSING = object()
+
+
+class TTLCache:
+	"""
+	LRU cache of up to `max_size` entries, every entry expires after its own ttl.
+	Concurrent get_or_load() calls for the same missing key wait for one load.
+	"""
+
+	def __init__(self, max_size: int = 10000):
+		self.__max_size: int = max_size
+		# key -> (expires at, value)
+		self.__data: OrderedDict = OrderedDict()
+		self.__loading: Dict[Hashable, Future] = {}
+		self.__lock: Lock = Lock()
+		self.hits: int = 0
+		self.misses: int = 0
+		self.coalesced: int = 0
+
+	def __len__(self):
+		return len(self.__data)
+
+	def get(self, key: Hashable, default: Any = None) -> Any:
+		with self.__lock:
+			value = self.__get(key)
+		return default if value is _MISSING else value
+
+	def put(self, key: Hashable, value: Any, ttl: float):
+		with self.__lock:
+			self.__put(key, value, ttl)
+
+	def get_or_load(self, key: Hashable, load: Callable[[], Any], ttl: float) -> Any:
+		with self.__lock:
+			value = self.__get(key)
+			if value is not _MISSING:
+				self.hits += 1
+				return value
+			future = self.__loading.get(key)
+			if future is not None:
+				self.coalesced += 1
+				owner = False
+			else:
+				self.misses += 1
+				owner = True
+				future = self.__loading[key] = Future()
+
+		if not owner:
+			return future.result()
+
+		try:
+			value = load()
+		except BaseException as ex:
+			with self.__lock:
+				if self.__loading.get(key) is future:
+					del self.__loading[key]
+			future.set_exception(ex)
+			raise
+		with self.__lock:
+			# do not store value which was invalidated while loading
+			if self.__loading.get(key) is future:
+				del self.__loading[key]
+				self.__put(key, value, ttl)
+		future.set_result(value)
+		return value
+
+	def invalidate(self, key: Hashable):
+		with self.__lock:
+			self.__data.pop(key, None)
+			self.__loading.pop(key, None)
+
+	def invalidate_if(self, predicate: Callable[[Hashable], bool]):
+		"""Removes all keys matching predicate, O(size)."""
+		with self.__lock:
+			for key in [k for k in self.__data if predicate(k)]:
+				del self.__data[key]
+			for key in [k for k in self.__loading if predicate(k)]:
+				del self.__loading[key]
+
+	def clear(self):
+		with self.__lock:
+			self.__data.clear()
+			self.__loading.clear()
+
+	def __get(self, key: Hashable) -> Any:
+		entry = self.__data.get(key)
+		if entry is None:
+			return _MISSING
+		if entry[0] <= monotonic():
+			del self.__data[key]
+			return _MISSING
+		self.__data.move_to_end(key)
+		return entry[1]
+
+	def __put(self, key: Hashable, value: Any, ttl: float):
+		self.__data[key] = (monotonic() + ttl, value)
+		self.__data.move_to_end(key)
+		while len(self.__data) > self.__max_size:
+			self.__data.popitem(last=False)
+
+
+# seconds, by API method
+METADATA_TTL = {
+	"getMe": 3600,
+	"getMyCommands": 600,
+	"getStickerSet": 3600,
+	"getChat": 300,
+	"getChatAdministrators": 120,
+	"getChatMember": 60,
+}
+
+# cache keys of these methods start with chat_id
+_CHAT_METHODS = {"getChat", "getChatAdministrators", "getChatMember"}
+
+
+class MetadataCache:
+	"""
+	Read-through cache for getMe, getMyCommands, getStickerSet, getChat, getChatAdministrators and getChatMember,
+	see API(cache=...). Feed incoming updates to observe() (or wrap your handler with it),
+	so membership and chat changes drop stale entries right away. API drops them too after its own
+	calls which change chats and members, like promote_chat_member() or set_chat_title().
+	Chats are invalidated both by numeric id and by @username, when username is known from a loaded chat
+	or an observed message.
+	Cached objects are shared between callers and must not be changed.
+	"""
+
+	def __init__(self, ttl: Optional[Dict[str, float]] = None, max_size: int = 10000):
+		self.__ttl: Dict[str, float] = dict(METADATA_TTL, **(ttl or {}))
+		self.__cache: TTLCache = TTLCache(max_size)
+		self.__max_size: int = max_size
+		# "@username" <-> chat id, both ways
+		self.__aliases: OrderedDict = OrderedDict()
+
+	@property
+	def stats(self) -> Dict[str, int]:
+		cache = self.__cache
+		return {"size": len(cache), "hits": cache.hits, "misses": cache.misses, "coalesced": cache.coalesced}
+
+	def get_or_load(self, api_method: str, key: Tuple, load: Callable[[], Any]) -> Any:
+		ttl = self.__ttl.get(api_method)
+		if not ttl:
+			return load()
+		if api_method in _CHAT_METHODS:
+			key = (self.__normalize(key[0]),) + key[1:]
+		value = self.__cache.get_or_load((api_method,) + key, load, ttl)
+		if api_method == "getChat":
+			self.__learn(value)
+		return value
+
+	def invalidate_chat(self, chat_id: Union[int, str]):
+		"""Drops everything known about the chat and its members."""
+		chat_ids = self.__chat_ids(chat_id)
+		self.__cache.invalidate_if(lambda key: key[0] in _CHAT_METHODS and key[1] in chat_ids)
+
+	def invalidate_member(self, chat_id: Union[int, str], user_id: int):
+		for chat_id in self.__chat_ids(chat_id):
+			self.__cache.invalidate(("getChatMember", chat_id, user_id))
+			self.__cache.invalidate(("getChatAdministrators", chat_id))
+
+	def clear(self):
+		self.__cache.clear()
+
+	def wrap(self, handler: Callable[[Update], None]) -> Callable[[Update], None]:
+		def observing_handler(update: Update):
+			self.observe(update)
+			handler(update)
+
+		return observing_handler
+
+	def observe(self, update: Update):
+		if update.message:
+			self.__observe_message(update.message)
+		if update.channel_post:
+			self.__observe_message(update.channel_post)
+
+	@staticmethod
+	def __normalize(chat_id: Union[int, str]) -> Union[int, str]:
+		# "-100123" and -100123 are the same chat, usernames are case insensitive
+		if isinstance(chat_id, str):
+			return int(chat_id) if chat_id.lstrip("-").isdigit() else chat_id.lower()
+		return chat_id
+
+	def __learn(self, chat: Chat):
+		if not chat.username:
+			return
+		username = f'@{chat.username.lower()}'
+		self.__aliases[username] = chat.id
+		self.__aliases[chat.id] = username
+		while len(self.__aliases) > self.__max_size:
+			self.__aliases.popitem(last=False)
+
+	def __chat_ids(self, chat_id: Union[int, str]) -> Tuple:
+		chat_id = self.__normalize(chat_id)
+		alias = self.__aliases.get(chat_id)
+		return (chat_id,) if alias is None else (chat_id, alias)
+
+	def __observe_message(self, message: Message):
+		self.__learn(message.chat)
+		chat_id = message.chat.id
+		if message.migrate_to_chat_id or message.migrate_from_chat_id:
+			self.invalidate_chat(chat_id)
+			self.invalidate_chat(message.migrate_to_chat_id or message.migrate_from_chat_id)
+			return
+		for user in message.new_chat_members or []:
+			self.invalidate_member(chat_id, user.id)
+		if message.left_chat_member:
+			self.invalidate_member(chat_id, message.left_chat_member.id)
+		if message.new_chat_title or message.new_chat_photo or message.delete_chat_photo or message.pinned_message:
+			for chat_id in self.__chat_ids(chat_id):
+				self.__cache.invalidate(("getChat", chat_id))
+
+
+# https://core.telegram.org/bots/api#answerinlinequery
+# no more than 50 results per query are allowed
+INLINE_PAGE_SIZE = 50
+
+
+def paginate(
+		results: Iterable[InlineQueryResult],
+		offset: str,
+		page_size: int = INLINE_PAGE_SIZE
+) -> Tuple[List[InlineQueryResult], str]:
+	"""
+	Takes one page from lazily generated results, items before the page are skipped without being kept.
+	offset is InlineQuery.offset: "" for the first page, then next_offset of the previous page.
+	Returns page and next_offset, "" when there are no more results.
+	"""
+	start = int(offset) if offset.isdigit() else 0
+	page = list(islice(results, start, start + page_size + 1))
+	if len(page) > page_size:
+		return page[:page_size], str(start + page_size)
+	return page, ""
+
+
+class InlineQueryCache:
+	"""
+	Keeps JSON encoded answer pages for inline queries, by normalized query text, offset and
+	user id for personal results. Popular queries are answered without generating results again.
+
+		cache.answer(api, update.inline_query, lambda query: search(query))
+
+	`produce` returns iterable of results for the query text, it is read only up to the requested page.
+	"""
+
+	def __init__(self, ttl: float = 300, max_size: int = 1000, page_size: int = INLINE_PAGE_SIZE):
+		self.__ttl: float = ttl
+		self.__page_size: int = page_size
+		self.__cache: TTLCache = TTLCache(max_size)
+
+	@property
+	def stats(self) -> Dict[str, int]:
+		cache = self.__cache
+		return {"size": len(cache), "hits": cache.hits, "misses": cache.misses, "coalesced": cache.coalesced}
+
+	@staticmethod
+	def normalize(query: str) -> str:
+		return " ".join(query.lower().split())
+
+	def get_page(
+			self,
+			inline_query: InlineQuery,
+			produce: Callable[[str], Iterable[InlineQueryResult]],
+			is_personal: bool = False
+	) -> Tuple[str, str]:
+		"""Returns encoded results and next_offset."""
+		query = self.normalize(inline_query.query)
+		offset = inline_query.offset or ""
+		user_id = inline_query.from_user.id if is_personal and inline_query.from_user else None
+
+		def load():
+			page, next_offset = paginate(produce(query), offset, self.__page_size)
+			return _dumps(page), next_offset
+
+		return self.__cache.get_or_load((query, offset, user_id), load, self.__ttl)
+
+	def answer(
+			self,
+			api: API,
+			inline_query: InlineQuery,
+			produce: Callable[[str], Iterable[InlineQueryResult]],
+			is_personal: bool = False,
+			**params
+	) -> bool:
+		"""Answers inline query with a cached page, params are passed to answer_inline_query."""
+		results, next_offset = self.get_page(inline_query, produce, is_personal)
+		return api.answer_inline_query(
+			inline_query.id, results, is_personal=is_personal or None, next_offset=next_offset, **params
+		)
+
+	def clear(self):
+		self.__cache.clear()
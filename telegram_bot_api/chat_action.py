@@ -0,0 +1,114 @@
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Dict, Optional, Union
+
+from telegram_bot_api import API
+from telegram_bot_api.timer import TimerWheel
+
+__all__ = ["CHAT_ACTION_INTERVAL", "ChatActionKeeper"]
+
+# https://core.telegram.org/bots/api#sendchataction
+# status is shown for 5 seconds or less
+CHAT_ACTION_INTERVAL = 4.5
+
+
+class _ChatState:
+	__slots__ = ("actions", "sent_at")
+
+	def __init__(self):
+		# action -> number of works which requested it, the last one is shown
+		self.actions: OrderedDict = OrderedDict()
+		self.sent_at: float = -1e9
+
+
+class ChatActionKeeper:
+	"""
+	Repeats sendChatAction while work is running:
+
+		with keeper.action(chat_id, "upload_photo"):
+			make_photo()
+
+	All chats are served by one TimerWheel and one sender thread.
+	Same chat gets at most one call per `interval`, when several actions are active there the latest one is shown.
+	"""
+
+	def __init__(self, api: API, interval: float = CHAT_ACTION_INTERVAL, wheel: Optional[TimerWheel] = None):
+		self.__api: API = api
+		self.__interval: float = interval
+		self.__wheel: TimerWheel = wheel or TimerWheel(tick=0.1)
+		self.__chats: Dict[Union[int, str], _ChatState] = {}
+		self.__lock: Lock = Lock()
+		self.__ready: Queue = Queue()
+		self.__sender: Optional[Thread] = None
+		self.sent: int = 0
+
+	@contextmanager
+	def action(self, chat_id: Union[int, str], action: str = "typing"):
+		self.start(chat_id, action)
+		try:
+			yield
+		finally:
+			self.stop(chat_id, action)
+
+	def start(self, chat_id: Union[int, str], action: str = "typing"):
+		with self.__lock:
+			state = self.__chats.get(chat_id)
+			if state is None:
+				state = self.__chats[chat_id] = _ChatState()
+			state.actions[action] = state.actions.pop(action, 0) + 1
+			if (id(self), chat_id) in self.__wheel:
+				# next call is already planned, it will show the latest action
+				return
+			if not self.__sender:
+				self.__sender = Thread(target=self.__send_ready, name="ChatActionKeeper", daemon=True)
+				self.__sender.start()
+		self.__ready.put(chat_id)
+
+	def stop(self, chat_id: Union[int, str], action: str = "typing"):
+		with self.__lock:
+			state = self.__chats.get(chat_id)
+			if state is None or action not in state.actions:
+				return
+			state.actions[action] -= 1
+			if not state.actions[action]:
+				del state.actions[action]
+			if not state.actions:
+				self.__wheel.cancel((id(self), chat_id))
+				# keep sent_at until interval is over, so the next work in this chat does not send early
+				left = state.sent_at + self.__interval - monotonic()
+				if left > 0:
+					self.__wheel.schedule((id(self), chat_id, "forget"), left, lambda: self.__forget(chat_id))
+				else:
+					del self.__chats[chat_id]
+
+	def __forget(self, chat_id: Union[int, str]):
+		with self.__lock:
+			state = self.__chats.get(chat_id)
+			if state is not None and not state.actions:
+				del self.__chats[chat_id]
+
+	def __send_ready(self):
+		while True:
+			chat_id = self.__ready.get()
+			with self.__lock:
+				state = self.__chats.get(chat_id)
+				if not state or not state.actions:
+					continue
+				wait = state.sent_at + self.__interval - monotonic()
+				if wait > 0:
+					# woke up early or was already sent by another path
+					if (id(self), chat_id) not in self.__wheel:
+						self.__wheel.schedule((id(self), chat_id), wait, lambda c=chat_id: self.__ready.put(c))
+					continue
+				action = next(reversed(state.actions))
+				state.sent_at = monotonic()
+				self.__wheel.schedule((id(self), chat_id), self.__interval, lambda c=chat_id: self.__ready.put(c))
+			try:
+				self.__api.send_chat_action(chat_id, action)
+				self.sent += 1
+			except Exception as ex:
+				logging.error(f'[ChatActionKeeper] send_chat_action to {chat_id} failed', exc_info=ex)
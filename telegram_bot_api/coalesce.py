@@ -0,0 +1,210 @@
+import logging
+from collections import OrderedDict
+from queue import Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Hashable, Optional, Tuple, Union
+
+from telegram_bot_api import API, ApiError, InlineKeyboardMarkup
+from telegram_bot_api.api import _dumps
+from telegram_bot_api.timer import TimerWheel
+
+__all__ = ["EditCoalescer"]
+
+
+class _Target:
+	__slots__ = ("sent_at", "sent", "pending", "pending_signature", "scheduled")
+
+	def __init__(self):
+		self.sent_at: float = -1e9
+		self.sent: Optional[str] = None
+		self.pending: Optional[dict] = None
+		self.pending_signature: Optional[str] = None
+		self.scheduled: bool = False
+
+
+class EditCoalescer:
+	"""
+	Rate limits edits of the same message. Every message is edited not more often than once per `min_interval`,
+	only the latest edit requested in between is sent, edits which do not change the message are skipped.
+	Edits are sent right away when allowed, delayed ones are sent by a background thread.
+	Up to `max_targets` recently edited messages are remembered.
+	"""
+
+	def __init__(
+			self,
+			api: API,
+			min_interval: float = 1.0,
+			max_targets: int = 10000,
+			wheel: Optional[TimerWheel] = None
+	):
+		self.__api: API = api
+		self.__min_interval: float = min_interval
+		self.__max_targets: int = max_targets
+		self.__wheel: TimerWheel = wheel or TimerWheel(tick=min(0.05, min_interval / 4))
+		self.__targets: OrderedDict = OrderedDict()
+		self.__lock: Lock = Lock()
+		self.__ready: Queue = Queue()
+		self.__sender: Optional[Thread] = None
+
+		self.sent: int = 0
+		self.skipped: int = 0
+		self.merged: int = 0
+
+	def edit_message_text(
+			self,
+			text: str,
+			chat_id: Optional[Union[int, str]] = None,
+			message_id: Optional[int] = None,
+			inline_message_id: Optional[str] = None,
+			**params
+	):
+		self.submit("edit_message_text", chat_id, message_id, inline_message_id, text=text, **params)
+
+	def edit_message_reply_markup(
+			self,
+			chat_id: Optional[Union[int, str]] = None,
+			message_id: Optional[int] = None,
+			inline_message_id: Optional[str] = None,
+			reply_markup: Optional[InlineKeyboardMarkup] = None
+	):
+		self.submit("edit_message_reply_markup", chat_id, message_id, inline_message_id, reply_markup=reply_markup)
+
+	def edit_message_live_location(
+			self,
+			latitude: float,
+			longitude: float,
+			chat_id: Optional[Union[int, str]] = None,
+			message_id: Optional[int] = None,
+			inline_message_id: Optional[str] = None,
+			**params
+	):
+		self.submit(
+			"edit_message_live_location", chat_id, message_id, inline_message_id,
+			latitude=latitude, longitude=longitude, **params
+		)
+
+	def submit(
+			self,
+			method: str,
+			chat_id: Optional[Union[int, str]],
+			message_id: Optional[int],
+			inline_message_id: Optional[str],
+			**params
+	):
+		"""Requests edit with API `method`. Text and markup of one message are rate limited separately."""
+		assert (chat_id and message_id) or inline_message_id, "chat_id and message_id or inline_message_id must be set"
+		key = (method, chat_id, message_id, inline_message_id)
+		params = dict(params, chat_id=chat_id, message_id=message_id, inline_message_id=inline_message_id)
+		signature = repr(sorted((k, _dumps(v)) for k, v in params.items() if v is not None))
+
+		with self.__lock:
+			target = self.__get_target(key)
+			if target.sent == signature:
+				# message already looks like this, delayed edit is not needed anymore
+				target.pending = target.pending_signature = None
+				if target.scheduled:
+					target.scheduled = False
+					self.__wheel.cancel((id(self), key))
+				self.skipped += 1
+				return
+			if target.pending is not None:
+				self.merged += 1
+			target.pending = params
+			target.pending_signature = signature
+			delay = target.sent_at + self.__min_interval - monotonic()
+			if target.scheduled:
+				return
+			if delay > 0:
+				target.scheduled = True
+				self.__wheel.schedule((id(self), key), delay, lambda: self.__ready.put(key))
+				self.__start_sender()
+				return
+			params = self.__take(target)
+
+		self.__send(key, params)
+
+	def flush(self):
+		"""Sends all delayed edits now, ignoring min_interval."""
+		with self.__lock:
+			ready = [(key, self.__take(t)) for key, t in self.__targets.items() if t.pending is not None]
+		for key, params in ready:
+			self.__wheel.cancel((id(self), key))
+			self.__send(key, params)
+
+	def __get_target(self, key: Hashable) -> _Target:
+		target = self.__targets.get(key)
+		if target is None:
+			target = self.__targets[key] = _Target()
+			if len(self.__targets) > self.__max_targets:
+				self.__evict()
+		else:
+			self.__targets.move_to_end(key)
+		return target
+
+	def __evict(self):
+		for key, target in self.__targets.items():
+			if target.pending is None:
+				del self.__targets[key]
+				return
+
+	def __take(self, target: _Target) -> dict:
+		params, target.pending = target.pending, None
+		target.sent, target.pending_signature = target.pending_signature, None
+		target.scheduled = False
+		target.sent_at = monotonic()
+		return params
+
+	def __start_sender(self):
+		if not self.__sender:
+			self.__sender = Thread(target=self.__send_ready, name="EditCoalescer", daemon=True)
+			self.__sender.start()
+
+	def __send_ready(self):
+		while True:
+			key = self.__ready.get()
+			with self.__lock:
+				target = self.__targets.get(key)
+				if target is None:
+					continue
+				if target.pending is None:
+					target.scheduled = False
+					continue
+				params = self.__take(target)
+			self.__send(key, params)
+
+	def __send(self, key: Tuple, params: dict):
+		method = key[0]
+		try:
+			getattr(self.__api, method)(**params)
+			self.sent += 1
+		except ApiError as ex:
+			if ex.code == 429:
+				self.__retry(key, params, ex.retry_after or self.__min_interval)
+			elif "not modified" not in ex.description:
+				logging.error(f'[EditCoalescer] {method} failed', exc_info=ex)
+				self.__forget(key)
+		except Exception as ex:
+			logging.error(f'[EditCoalescer] {method} failed', exc_info=ex)
+			self.__forget(key)
+
+	def __forget(self, key: Tuple):
+		# edit was not applied, so the same content must not be skipped next time
+		with self.__lock:
+			target = self.__targets.get(key)
+			if target is not None:
+				target.sent = None
+
+	def __retry(self, key: Tuple, params: dict, delay: float):
+		with self.__lock:
+			target = self.__targets.get(key)
+			if target is None:
+				return
+			if target.pending is None:
+				target.pending, target.pending_signature = params, target.sent
+			target.sent = None
+			target.sent_at = monotonic() + delay - self.__min_interval
+			if not target.scheduled:
+				target.scheduled = True
+				self.__wheel.schedule((id(self), key), delay, lambda: self.__ready.put(key))
+				self.__start_sender()
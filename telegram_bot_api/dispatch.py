@@ -0,0 +1,159 @@
+import logging
+from collections import OrderedDict
+from queue import Queue
+from threading import Lock, Thread
+from typing import Callable, List, Optional
+
+from telegram_bot_api import Update, Message
+from telegram_bot_api.timer import TimerWheel
+
+__all__ = ["MAX_ALBUM_SIZE", "UpdateDeduplicator", "MediaGroupCollector"]
+
+# Telegram does not put more than 10 items in one album
+MAX_ALBUM_SIZE = 10
+
+
+class UpdateDeduplicator:
+	"""
+	Drops updates which were already seen.
+	Keeps a sliding window bitmap of the last `window` update ids, memory does not depend on traffic.
+	Telegram ids are increasing, but after a week without updates Telegram starts from a random update_id.
+	So an id older than the window is not a replay: the window is started over from it and the update is delivered.
+	"""
+
+	def __init__(self, handler: Callable[[Update], None], window: int = 4096):
+		assert window > 0, "window must be positive"
+		self.__handler: Callable[[Update], None] = handler
+		self.__window: int = window
+		self.__bits: bytearray = bytearray((window + 7) // 8)
+		self.__last: int = -1
+		self.__lock: Lock = Lock()
+		self.dropped: int = 0
+
+	def __call__(self, update: Update):
+		if self.check(update.update_id):
+			self.__handler(update)
+
+	def check(self, update_id: int) -> bool:
+		"""Marks update_id as seen. Returns False if it was seen before."""
+		with self.__lock:
+			window = self.__window
+			if self.__last < 0:
+				self.__last = update_id
+			elif update_id > self.__last:
+				self.__clear(self.__last + 1, update_id, window)
+				self.__last = update_id
+			elif update_id <= self.__last - window:
+				# id sequence was reset
+				self.__bits[:] = bytes(len(self.__bits))
+				self.__last = update_id
+
+			index = update_id % window
+			mask = 1 << (index & 7)
+			if self.__bits[index >> 3] & mask:
+				self.dropped += 1
+				return False
+			self.__bits[index >> 3] |= mask
+			return True
+
+	def __clear(self, start: int, end: int, window: int):
+		# forget ids which are pushed out of the window by the new last id
+		if end - start + 1 >= window:
+			self.__bits[:] = bytes(len(self.__bits))
+			return
+		bits = self.__bits
+		for i in range(start, end + 1):
+			index = i % window
+			bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+
+class MediaGroupCollector:
+	"""
+	Collects messages of one album (same media_group_id) and delivers them to album_handler as one list.
+	Album is delivered when no new items came for `window` seconds, or when it is full.
+	Other updates are passed to handler as is.
+	When more than max_groups albums are pending, the oldest one is delivered early.
+	Albums delivered by timeout are handled by a background thread, so album_handler can run
+	at the same time as handler.
+	Updates of pending albums are already confirmed to Telegram: call flush() after Pooling.stop(),
+	otherwise they are lost.
+	"""
+
+	def __init__(
+			self,
+			handler: Callable[[Update], None],
+			album_handler: Callable[[List[Update]], None],
+			window: float = 0.5,
+			max_groups: int = 1000,
+			wheel: Optional[TimerWheel] = None
+	):
+		self.__handler: Callable[[Update], None] = handler
+		self.__album_handler: Callable[[List[Update]], None] = album_handler
+		self.__window: float = window
+		self.__max_groups: int = max_groups
+		self.__wheel: TimerWheel = wheel or TimerWheel(tick=min(0.05, window / 4))
+		self.__groups: OrderedDict = OrderedDict()
+		self.__lock: Lock = Lock()
+		self.__expired: Queue = Queue()
+		self.__worker: Optional[Thread] = None
+
+	def __len__(self):
+		return len(self.__groups)
+
+	def __call__(self, update: Update):
+		message = self.get_message(update)
+		if not message or not message.media_group_id:
+			self.__handler(update)
+			return
+
+		ready = []
+		group_id = message.media_group_id
+		with self.__lock:
+			group = self.__groups.get(group_id)
+			if group is None:
+				if len(self.__groups) >= self.__max_groups:
+					ready.append(self.__pop(next(iter(self.__groups))))
+				group = self.__groups[group_id] = []
+			group.append(update)
+			if len(group) >= MAX_ALBUM_SIZE:
+				ready.append(self.__pop(group_id))
+			else:
+				self.__wheel.schedule((id(self), group_id), self.__window, lambda: self.__expired.put(group_id))
+				if not self.__worker:
+					self.__worker = Thread(target=self.__deliver_expired, name="MediaGroupCollector", daemon=True)
+					self.__worker.start()
+
+		for album in ready:
+			self.__deliver(album)
+
+	def flush(self):
+		"""Delivers all pending albums right away."""
+		with self.__lock:
+			albums = [self.__pop(group_id) for group_id in list(self.__groups)]
+		for album in albums:
+			self.__deliver(album)
+
+	@staticmethod
+	def get_message(update: Update) -> Optional[Message]:
+		return update.message or update.channel_post
+
+	def __deliver_expired(self):
+		while True:
+			group_id = self.__expired.get()
+			with self.__lock:
+				if group_id not in self.__groups:
+					# delivered by flush() or when full
+					continue
+				album = self.__pop(group_id)
+			try:
+				self.__deliver(album)
+			except Exception as ex:
+				logging.error("[MediaGroupCollector] album_handler failed", exc_info=ex)
+
+	def __pop(self, group_id: str) -> List[Update]:
+		self.__wheel.cancel((id(self), group_id))
+		return self.__groups.pop(group_id)
+
+	def __deliver(self, album: List[Update]):
+		album.sort(key=lambda u: self.get_message(u).message_id)
+		self.__album_handler(album)
@@ -0,0 +1,345 @@
+import hashlib
+import json
+import logging
+import random
+import ssl
+import time
+from collections import Counter
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from telegram_bot_api.metrics import _http_server
+
+__all__ = ["FakeBotApi"]
+
+# upload methods and the field with the file
+_UPLOAD_FIELDS = {
+	"sendPhoto": "photo",
+	"sendAudio": "audio",
+	"sendDocument": "document",
+	"sendVideo": "video",
+	"sendAnimation": "animation",
+	"sendVoice": "voice",
+	"sendVideoNote": "video_note",
+	"sendSticker": "sticker",
+}
+
+# methods which are accepted and answered with True
+_TRUE_METHODS = {
+	"sendChatAction", "answerCallbackQuery", "answerInlineQuery", "deleteMessage",
+	"setWebhook", "deleteWebhook", "setMyCommands", "pinChatMessage", "unpinChatMessage",
+}
+
+_BOT = {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+
+def _parse_value(value: str) -> Any:
+	# API sends numbers and booleans as text and objects as JSON
+	if value[:1] in "{[" or value in ("true", "false") or value.lstrip("-").isdigit():
+		try:
+			return json.loads(value)
+		except ValueError:
+			pass
+	return value
+
+
+def _parse_multipart(content_type: str, body: bytes) -> Tuple[Dict[str, Any], Dict[str, Tuple[str, bytes]]]:
+	"""Returns form fields and files: field -> (file name, content)."""
+	boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+	fields = {}
+	files = {}
+	for part in body.split(b"--" + boundary)[1:]:
+		if part.startswith(b"--"):
+			break
+		head, _, content = part[2:].partition(b"\r\n\r\n")
+		content = content[:-2]
+		disposition = {}
+		for line in head.decode().split("\r\n"):
+			if line.lower().startswith("content-disposition:"):
+				for item in line.split(";")[1:]:
+					key, _, value = item.strip().partition("=")
+					disposition[key] = value.strip('"')
+		name = disposition.get("name")
+		if "filename" in disposition:
+			files[name] = (disposition["filename"], content)
+		else:
+			fields[name] = _parse_value(content.decode())
+	return fields, files
+
+
+class FakeBotApi:
+	"""
+	Local stand-in for Bot API server, for tests and load tests without token and network:
+
+		server = FakeBotApi().start()
+		api = API("any token", host=server.host, secure=False)
+		server.push_message(chat_id=1, text="/start")
+
+	Implements getUpdates with long polling and offsets, getMe, sendMessage, upload methods (sendPhoto,
+	sendDocument and others), getFile and file download. Sent messages are kept in `sent`.
+	Errors are injected with `error_rate` (random share of calls) or fail_next(): 429 comes with retry_after.
+	`latency` seconds are added to every call.
+	Pass ssl_context to serve HTTPS with your own certificate.
+	"""
+
+	def __init__(
+			self,
+			host: str = "127.0.0.1",
+			port: int = 0,
+			latency: float = 0.0,
+			error_rate: float = 0.0,
+			error_code: int = 429,
+			retry_after: int = 1,
+			ssl_context: Optional[ssl.SSLContext] = None,
+			seed: Optional[int] = None
+	):
+		self.__address: Tuple[str, int] = (host, port)
+		self.__ssl_context: Optional[ssl.SSLContext] = ssl_context
+		self.__server: Optional[HTTPServer] = None
+		self.__running: bool = False
+		self.__random: random.Random = random.Random(seed)
+		self.__lock: Lock = Lock()
+		self.__updates_ready: Condition = Condition(self.__lock)
+
+		self.__updates: List[dict] = []
+		self.__next_update_id: int = 1
+		self.__next_message_id: int = 1
+		self.__files: Dict[str, bytes] = {}
+		self.__fail_next: List[Tuple[int, Optional[int]]] = []
+
+		self.latency: float = latency
+		self.error_rate: float = error_rate
+		self.error_code: int = error_code
+		self.retry_after: int = retry_after
+		self.sent: List[dict] = []
+		self.calls: Counter = Counter()
+		self.errors: Counter = Counter()
+
+	@property
+	def host(self) -> str:
+		"""host:port to pass to API(host=...)"""
+		return f'{self.__address[0]}:{self.port}'
+
+	@property
+	def port(self) -> int:
+		return self.__server.server_port if self.__server else self.__address[1]
+
+	def start(self) -> "FakeBotApi":
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+			# headers and body are written separately, with Nagle's algorithm keep-alive calls wait for delayed ACK
+			disable_nagle_algorithm = True
+
+			def do_POST(self):
+				length = int(self.headers.get("Content-Length") or 0)
+				body = self.rfile.read(length)
+				server._handle(self, "POST", body)
+
+			def do_GET(self):
+				server._handle(self, "GET", b"")
+
+			def log_message(self, format, *args):
+				logging.debug(f'[FakeBotApi] {format % args}')
+
+		self.__server = _http_server(self.__address, Handler)
+		if self.__ssl_context:
+			self.__server.socket = self.__ssl_context.wrap_socket(self.__server.socket, server_side=True)
+		self.__running = True
+		Thread(target=self.__server.serve_forever, name="FakeBotApi", daemon=True).start()
+		logging.info(f'[FakeBotApi] serving on {self.host}')
+		return self
+
+	def stop(self):
+		if self.__server:
+			with self.__lock:
+				# long polling requests return right away
+				self.__running = False
+				self.__updates_ready.notify_all()
+			self.__server.shutdown()
+			self.__server.server_close()
+			self.__server = None
+
+	def push_update(self, **fields) -> int:
+		"""Adds update, for example push_update(callback_query={...}). Returns update_id."""
+		with self.__lock:
+			update_id = self.__next_update_id
+			self.__next_update_id += 1
+			self.__updates.append(dict(fields, update_id=update_id))
+			self.__updates_ready.notify_all()
+		return update_id
+
+	def push_message(self, chat_id: int = 1, text: str = "", **fields) -> int:
+		"""Adds update with a private message from user `chat_id`."""
+		user = {"id": chat_id, "is_bot": False, "first_name": f'User {chat_id}'}
+		message = {
+			"message_id": self.__new_message_id(),
+			"date": int(time.time()),
+			"chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+			"from": user,
+			"text": text,
+		}
+		if text.startswith("/"):
+			message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+		message.update(fields)
+		return self.push_update(message=message)
+
+	def fail_next(self, count: int = 1, code: int = 429, retry_after: Optional[int] = None):
+		"""Next `count` calls fail with `code`."""
+		with self.__lock:
+			self.__fail_next.extend([(code, retry_after)] * count)
+
+	def pending_updates(self) -> int:
+		with self.__lock:
+			return len(self.__updates)
+
+	def _handle(self, request: BaseHTTPRequestHandler, method: str, body: bytes):
+		path = urlsplit(request.path).path
+		if self.latency:
+			sleep(self.latency)
+
+		if method == "GET" and path.startswith("/file/bot"):
+			file_id = path.rsplit("/", 1)[-1]
+			data = self.__files.get(file_id)
+			if data is None:
+				self.__reply(request, 404, b'{"ok":false,"error_code":404,"description":"Not Found"}')
+			else:
+				self.calls["downloadFile"] += 1
+				self.__reply(request, 200, data, "application/octet-stream")
+			return
+
+		api_method = path.rsplit("/", 1)[-1]
+		self.calls[api_method] += 1
+		error = self.__next_error()
+		if error:
+			code, retry_after = error
+			self.errors[api_method] += 1
+			self.__error(request, code, retry_after)
+			return
+
+		content_type = request.headers.get("Content-Type") or ""
+		if content_type.startswith("multipart/form-data"):
+			params, files = _parse_multipart(content_type, body)
+		else:
+			params = {k: _parse_value(v) for k, v in parse_qsl(body.decode(), keep_blank_values=True)}
+			files = {}
+
+		try:
+			result = self.__call(api_method, params, files)
+		except KeyError as ex:
+			self.__error(request, 400, description=f'Bad Request: {ex.args[0]} is required')
+			return
+		if result is None:
+			self.__error(request, 404, description="Not Found")
+			return
+		self.__reply(request, 200, json.dumps({"ok": True, "result": result}).encode())
+
+	def __call(self, api_method: str, params: dict, files: Dict[str, Tuple[str, bytes]]) -> Any:
+		if api_method == "getUpdates":
+			return self.__get_updates(params)
+		if api_method == "getMe":
+			return _BOT
+		if api_method == "sendMessage":
+			return self.__send(params, text=str(params["text"]))
+		if api_method in _UPLOAD_FIELDS:
+			field = _UPLOAD_FIELDS[api_method]
+			file = self.__store_file(field, files[field][1] if field in files else params[field])
+			media = [file] if field == "photo" else file
+			return self.__send(params, **{field: media, "caption": params.get("caption")})
+		if api_method == "getFile":
+			file_id = params["file_id"]
+			data = self.__files.get(file_id)
+			if data is None:
+				return None
+			return {
+				"file_id": file_id,
+				"file_unique_id": file_id[:16],
+				"file_size": len(data),
+				"file_path": f'files/{file_id}',
+			}
+		if api_method in _TRUE_METHODS:
+			return True
+		return None
+
+	def __get_updates(self, params: dict) -> List[dict]:
+		offset = params.get("offset") or 0
+		limit = params.get("limit") or 100
+		timeout = params.get("timeout") or 0
+		deadline = monotonic() + timeout
+		with self.__lock:
+			# offset confirms all updates below it
+			self.__updates = [u for u in self.__updates if u["update_id"] >= offset]
+			while not self.__updates and self.__running:
+				left = deadline - monotonic()
+				if left <= 0:
+					break
+				self.__updates_ready.wait(left)
+			return self.__updates[:limit]
+
+	def __send(self, params: dict, **content) -> dict:
+		chat_id = params["chat_id"]
+		message = {
+			"message_id": self.__new_message_id(),
+			"date": int(time.time()),
+			"chat": {"id": chat_id, "type": "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"},
+			"from": _BOT,
+		}
+		message.update({k: v for k, v in content.items() if v is not None})
+		with self.__lock:
+			self.sent.append(message)
+		return message
+
+	def __store_file(self, field: str, data: Any) -> dict:
+		if isinstance(data, bytes):
+			file_id = f'{field}-{hashlib.sha1(data).hexdigest()}'
+			with self.__lock:
+				self.__files[file_id] = data
+		else:
+			# sent by file_id
+			file_id = str(data)
+		size = len(self.__files.get(file_id, b""))
+		file = {"file_id": file_id, "file_unique_id": file_id[:16], "file_size": size}
+		if field == "photo":
+			file.update(width=100, height=100)
+		return file
+
+	def __new_message_id(self) -> int:
+		with self.__lock:
+			message_id = self.__next_message_id
+			self.__next_message_id += 1
+		return message_id
+
+	def __next_error(self) -> Optional[Tuple[int, Optional[int]]]:
+		with self.__lock:
+			if self.__fail_next:
+				return self.__fail_next.pop(0)
+			if self.error_rate and self.__random.random() < self.error_rate:
+				return self.error_code, None
+		return None
+
+	def __error(self, request, code: int, retry_after: Optional[int] = None, description: Optional[str] = None):
+		data = {"ok": False, "error_code": code}
+		if code == 429:
+			retry_after = retry_after or self.retry_after
+			data["description"] = f'Too Many Requests: retry after {retry_after}'
+			data["parameters"] = {"retry_after": retry_after}
+		else:
+			data["description"] = description or HTTPStatus(code).phrase
+		self.__reply(request, code, json.dumps(data).encode())
+
+	@staticmethod
+	def __reply(request, code: int, data: bytes, content_type: str = "application/json"):
+		request.send_response(code)
+		request.send_header("Content-Type", content_type)
+		request.send_header("Content-Length", str(len(data)))
+		request.end_headers()
+		try:
+			request.wfile.write(data)
+		except ConnectionError:
+			# client stopped waiting, like Pooling.stop() breaking long polling
+			logging.debug("[FakeBotApi] client disconnected before response")
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock, get_ident
+from typing import Any, Dict
+
+from telegram_bot_api import API
+
+__all__ = ["FileCache"]
+
+_INDEX = "index.json"
+
+
+class FileCache:
+	"""
+	Keeps downloaded files in `directory`, by file_unique_id, so the same file is downloaded once:
+
+		path = cache.get(api, message.document)
+
+	`media` is File, PhotoSize, Document or any other object with file_id and file_unique_id.
+	A hit skips both get_file and the download. Least recently used files are deleted
+	when the cache grows over `max_bytes`. The index is kept in the same directory and survives restarts.
+	"""
+
+	def __init__(self, directory: str, max_bytes: int = 256 << 20):
+		self.__directory: str = directory
+		self.__max_bytes: int = max_bytes
+		# file_unique_id -> size, least recently used first
+		self.__files: OrderedDict = OrderedDict()
+		self.__size: int = 0
+		self.__loading: Dict[str, Future] = {}
+		self.__lock: Lock = Lock()
+		self.hits: int = 0
+		self.misses: int = 0
+		os.makedirs(directory, exist_ok=True)
+		self.__load()
+
+	def __len__(self):
+		return len(self.__files)
+
+	@property
+	def size(self) -> int:
+		"""Bytes used by cached files."""
+		return self.__size
+
+	def get(self, api: API, media: Any) -> str:
+		"""Returns path of the cached file, downloads it on a miss."""
+		uid = media.file_unique_id
+		with self.__lock:
+			if uid in self.__files:
+				self.__files.move_to_end(uid)
+				self.hits += 1
+				return self.__path(uid)
+			future = self.__loading.get(uid)
+			owner = future is None
+			if owner:
+				self.misses += 1
+				future = self.__loading[uid] = Future()
+
+		if not owner:
+			return future.result()
+
+		try:
+			path = self.__download(api, media)
+		except BaseException as ex:
+			with self.__lock:
+				self.__loading.pop(uid, None)
+			future.set_exception(ex)
+			raise
+		future.set_result(path)
+		return path
+
+	def read(self, api: API, media: Any) -> bytes:
+		while True:
+			path = self.get(api, media)
+			try:
+				with open(path, "rb") as f:
+					return f.read()
+			except FileNotFoundError:
+				# evicted right after get()
+				self.forget(media.file_unique_id)
+
+	def forget(self, file_unique_id: str):
+		with self.__lock:
+			self.__remove(file_unique_id)
+			self.__save()
+
+	def save(self):
+		"""Writes the index, so the order of recently used files is kept after restart."""
+		with self.__lock:
+			self.__save()
+
+	def __download(self, api: API, media: Any) -> str:
+		uid = media.file_unique_id
+		# File already knows where to download from
+		file_path = getattr(media, "file_path", None) or api.get_file(media.file_id).file_path
+		data = api.download_file(file_path)
+
+		path = self.__path(uid)
+		tmp = f'{path}.{get_ident()}.tmp'
+		with open(tmp, "wb") as f:
+			f.write(data)
+		os.replace(tmp, path)
+
+		with self.__lock:
+			del self.__loading[uid]
+			# the file is already replaced by the new one, only the size of the old entry is dropped
+			self.__size -= self.__files.pop(uid, 0)
+			self.__files[uid] = len(data)
+			self.__size += len(data)
+			self.__evict()
+			self.__save()
+		return path
+
+	def __evict(self):
+		# the newest file is kept even if it alone is over the limit
+		while self.__size > self.__max_bytes and len(self.__files) > 1:
+			self.__remove(next(iter(self.__files)))
+
+	def __path(self, file_unique_id: str) -> str:
+		return os.path.join(self.__directory, file_unique_id)
+
+	def __remove(self, file_unique_id: str):
+		size = self.__files.pop(file_unique_id, None)
+		if size is None:
+			return
+		self.__size -= size
+		try:
+			os.remove(self.__path(file_unique_id))
+		except OSError:
+			pass
+
+	def __load(self):
+		index = os.path.join(self.__directory, _INDEX)
+		names = set(os.listdir(self.__directory))
+		try:
+			with open(index, "r") as f:
+				files = json.load(f)
+		except (OSError, ValueError):
+			files = []
+
+		for uid, size in files:
+			if uid in names and os.path.getsize(self.__path(uid)) == size:
+				self.__files[uid] = size
+				self.__size += size
+
+		for name in names - set(self.__files) - {_INDEX}:
+			path = self.__path(name)
+			if name.endswith(".tmp"):
+				# interrupted write
+				os.remove(path)
+			elif os.path.isfile(path):
+				# written before the index was saved
+				self.__files[name] = os.path.getsize(path)
+				self.__size += self.__files[name]
+		self.__evict()
+		logging.info(f'[FileCache] {len(self.__files)} files, {self.__size} bytes in {self.__directory}')
+
+	def __save(self):
+		index = os.path.join(self.__directory, _INDEX)
+		tmp = f'{index}.tmp'
+		with open(tmp, "w") as f:
+			json.dump(list(self.__files.items()), f)
+		os.replace(tmp, index)
@@ -0,0 +1,299 @@
+import logging
+import time
+from bisect import bisect_left
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from telegram_bot_api import API, Update
+
+__all__ = ["LATENCY_BUCKETS", "LAG_BUCKETS", "Histogram", "ApiMetrics", "UpdateStats", "MetricsServer"]
+
+# seconds, upper bounds of latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# seconds, update lag is counted from message date which has one second precision
+LAG_BUCKETS = (1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class Histogram:
+	"""Counts observed values by buckets, the last bucket is +Inf."""
+
+	__slots__ = ("buckets", "counts", "sum", "count")
+
+	def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+		self.buckets: Sequence[float] = buckets
+		self.counts: List[int] = [0] * (len(buckets) + 1)
+		self.sum: float = 0.0
+		self.count: int = 0
+
+	def observe(self, value: float):
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	def quantile(self, q: float) -> Optional[float]:
+		"""Upper bound of the bucket holding q-quantile, None when empty."""
+		if not self.count:
+			return None
+		rank = q * self.count
+		total = 0
+		for bound, count in zip(self.buckets, self.counts):
+			total += count
+			if total >= rank:
+				return bound
+		return float("inf")
+
+	def cumulative(self) -> List[Tuple[float, int]]:
+		result = []
+		total = 0
+		for bound, count in zip(tuple(self.buckets) + (float("inf"),), self.counts):
+			total += count
+			result.append((bound, total))
+		return result
+
+
+class _CallStats:
+	__slots__ = ("latency", "sent", "received")
+
+	def __init__(self, buckets: Sequence[float]):
+		self.latency: Histogram = Histogram(buckets)
+		self.sent: int = 0
+		self.received: int = 0
+
+
+class ApiMetrics:
+	"""
+	Counts API calls by method and status, see API(metrics=...): latency histogram,
+	bytes sent and bytes received. Status is HTTP or Bot API error code, 0 for network errors.
+	"""
+
+	def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+		self.__buckets: Sequence[float] = buckets
+		self.__calls: Dict[Tuple[str, int], _CallStats] = {}
+		self.__lock: Lock = Lock()
+
+	def observe(self, api_method: str, status: int, seconds: float, sent: int, received: int):
+		key = (api_method, status)
+		with self.__lock:
+			stats = self.__calls.get(key)
+			if stats is None:
+				stats = self.__calls[key] = _CallStats(self.__buckets)
+			stats.latency.observe(seconds)
+			stats.sent += sent
+			stats.received += received
+
+	def snapshot(self) -> Dict[str, Dict[int, dict]]:
+		"""{method: {status: {count, seconds, p50, p99, sent, received}}}"""
+		result = {}
+		with self.__lock:
+			for (api_method, status), stats in self.__calls.items():
+				latency = stats.latency
+				result.setdefault(api_method, {})[status] = {
+					"count": latency.count,
+					"seconds": latency.sum,
+					"p50": latency.quantile(0.5),
+					"p99": latency.quantile(0.99),
+					"sent": stats.sent,
+					"received": stats.received,
+				}
+		return result
+
+	def reset(self):
+		with self.__lock:
+			self.__calls.clear()
+
+	def render(self) -> str:
+		"""Prometheus text format."""
+		lines = ["# TYPE telegram_api_request_duration_seconds histogram"]
+		sent = []
+		received = []
+		with self.__lock:
+			for (api_method, status), stats in sorted(self.__calls.items()):
+				labels = f'method="{api_method}",status="{status}"'
+				for bound, total in stats.latency.cumulative():
+					le = "+Inf" if bound == float("inf") else repr(bound)
+					lines.append(f'telegram_api_request_duration_seconds_bucket{{{labels},le="{le}"}} {total}')
+				lines.append(f'telegram_api_request_duration_seconds_sum{{{labels}}} {stats.latency.sum}')
+				lines.append(f'telegram_api_request_duration_seconds_count{{{labels}}} {stats.latency.count}')
+				sent.append(f'telegram_api_sent_bytes_total{{{labels}}} {stats.sent}')
+				received.append(f'telegram_api_received_bytes_total{{{labels}}} {stats.received}')
+		lines.append("# TYPE telegram_api_sent_bytes_total counter")
+		lines.extend(sent)
+		lines.append("# TYPE telegram_api_received_bytes_total counter")
+		lines.extend(received)
+		return "\n".join(lines) + "\n"
+
+
+class UpdateStats:
+	"""
+	Shows how far the bot is behind, see Pooling(stats=...). Webhook handlers are measured with track().
+	lag: seconds from message date to handler start, only for updates with a message
+	backlog: updates received but not handled yet
+	dispatch: seconds from getUpdates response to handler start
+	Webhook info (pending_update_count, last_error_date) is sampled by start_sampling().
+	"""
+
+	def __init__(self, lag_buckets: Sequence[float] = LAG_BUCKETS, buckets: Sequence[float] = LATENCY_BUCKETS):
+		self.__lag: Histogram = Histogram(lag_buckets)
+		self.__dispatch: Histogram = Histogram(buckets)
+		self.__lock: Lock = Lock()
+		self.__sampler: Optional[Thread] = None
+		self.__stop_sampling: Event = Event()
+
+		self.backlog: int = 0
+		self.last_lag: Optional[float] = None
+		self.pending_update_count: Optional[int] = None
+		self.last_error_date: Optional[int] = None
+		self.last_error_message: Optional[str] = None
+
+	def add_backlog(self, count: int):
+		with self.__lock:
+			self.backlog += count
+
+	def on_dispatched(self, update: Update, received_at: float):
+		"""Called when handler starts, received_at is monotonic() time when update was received."""
+		now = monotonic()
+		message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+		lag = None
+		if message:
+			lag = max(0.0, time.time() - (message.edit_date or message.date))
+		with self.__lock:
+			self.__dispatch.observe(now - received_at)
+			if lag is not None:
+				self.__lag.observe(lag)
+				self.last_lag = lag
+
+	def track(self, handler: Callable[[Update], None]) -> Callable[[Update], None]:
+		"""Wraps webhook handler, which gets updates as soon as they are received."""
+
+		def tracked_handler(update: Update):
+			self.add_backlog(1)
+			try:
+				self.on_dispatched(update, monotonic())
+				handler(update)
+			finally:
+				self.add_backlog(-1)
+
+		return tracked_handler
+
+	def sample_webhook(self, api: API):
+		info = api.get_webhook_info()
+		self.pending_update_count = info.pending_update_count
+		self.last_error_date = info.last_error_date
+		self.last_error_message = info.last_error_message
+
+	def start_sampling(self, api: API, interval: float = 60):
+		"""Calls get_webhook_info every `interval` seconds on a background thread."""
+		if self.__sampler:
+			return
+		self.__stop_sampling.clear()
+		self.__sampler = Thread(target=self.__sample, args=(api, interval), name="UpdateStats", daemon=True)
+		self.__sampler.start()
+
+	def stop_sampling(self):
+		if self.__sampler:
+			self.__stop_sampling.set()
+			self.__sampler.join()
+			self.__sampler = None
+
+	def snapshot(self) -> dict:
+		with self.__lock:
+			return {
+				"backlog": self.backlog,
+				"lag": self.last_lag,
+				"lag_p50": self.__lag.quantile(0.5),
+				"lag_p99": self.__lag.quantile(0.99),
+				"dispatch_p50": self.__dispatch.quantile(0.5),
+				"dispatch_p99": self.__dispatch.quantile(0.99),
+				"dispatched": self.__dispatch.count,
+				"pending_update_count": self.pending_update_count,
+				"last_error_date": self.last_error_date,
+			}
+
+	def render(self) -> str:
+		"""Prometheus text format."""
+		lines = ["# TYPE telegram_updates_backlog gauge", f'telegram_updates_backlog {self.backlog}']
+		with self.__lock:
+			for name, histogram in (("lag", self.__lag), ("dispatch", self.__dispatch)):
+				lines.append(f'# TYPE telegram_updates_{name}_seconds histogram')
+				for bound, total in histogram.cumulative():
+					le = "+Inf" if bound == float("inf") else repr(bound)
+					lines.append(f'telegram_updates_{name}_seconds_bucket{{le="{le}"}} {total}')
+				lines.append(f'telegram_updates_{name}_seconds_sum {histogram.sum}')
+				lines.append(f'telegram_updates_{name}_seconds_count {histogram.count}')
+		if self.pending_update_count is not None:
+			lines.append("# TYPE telegram_webhook_pending_updates gauge")
+			lines.append(f'telegram_webhook_pending_updates {self.pending_update_count}')
+		if self.last_error_date is not None:
+			lines.append("# TYPE telegram_webhook_last_error_timestamp_seconds gauge")
+			lines.append(f'telegram_webhook_last_error_timestamp_seconds {self.last_error_date}')
+		return "\n".join(lines) + "\n"
+
+	def __sample(self, api: API, interval: float):
+		while True:
+			try:
+				self.sample_webhook(api)
+			except Exception as ex:
+				logging.error("[UpdateStats] get_webhook_info failed", exc_info=ex)
+			if self.__stop_sampling.wait(interval):
+				return
+
+
+def _http_server(address: Tuple[str, int], handler: type) -> Any:
+	"""Threading HTTP server. http.server is imported only when a server starts, not with the package."""
+	import socketserver
+	from http.server import HTTPServer
+
+	class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+		daemon_threads = True
+
+	return ThreadingHTTPServer(address, handler)
+
+
+class MetricsServer:
+	"""
+	Serves metrics in Prometheus text format at http://host:port/metrics.
+	Every source is an object with render() -> str, for example ApiMetrics.
+	"""
+
+	def __init__(self, *sources, host: str = "127.0.0.1", port: int = 9464):
+		self.__sources: tuple = sources
+		self.__address: Tuple[str, int] = (host, port)
+		self.__server: Optional[Any] = None
+
+	@property
+	def port(self) -> int:
+		"""Actual port, useful when started with port 0."""
+		return self.__server.server_port if self.__server else self.__address[1]
+
+	def render(self) -> str:
+		return "".join(source.render() for source in self.__sources)
+
+	def start(self):
+		from http.server import BaseHTTPRequestHandler
+		metrics = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split("?")[0] != "/metrics":
+					self.send_error(404)
+					return
+				body = metrics.render().encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				logging.debug(f'[MetricsServer] {format % args}')
+
+		self.__server = _http_server(self.__address, Handler)
+		Thread(target=self.__server.serve_forever, name="MetricsServer", daemon=True).start()
+		logging.info(f'[MetricsServer] serving on {self.__address[0]}:{self.port}')
+
+	def stop(self):
+		if self.__server:
+			self.__server.shutdown()
+			self.__server.server_close()
+			self.__server = None
@@ -1,53 +1,327 @@
 import logging
-from threading import Thread
-from time import sleep
-from typing import Callable
+from http.client import HTTPException
+from queue import Queue, Empty
+from threading import Thread, Event, Lock, Semaphore, current_thread
+from time import monotonic
+from typing import Any, Callable, List, Optional, Tuple
 
 from telegram_bot_api import API, Update
 
+__all__ = ["AdaptiveBatching", "Pooling"]
+
+
+class AdaptiveBatching:
+	"""
+	Chooses getUpdates `limit` and long polling `timeout` for Pooling.
+	Handler capacity is measured as moving average of handler time. Limit is set so that one batch
+	together with already queued updates is handled in about `target_latency` seconds.
+	When nothing is queued long polling is used, so new updates are delivered as soon as they come.
+	Pooling.stop() breaks the long polling request when API supports interrupt(), otherwise
+	stopping waits for it up to `max_timeout` seconds.
+	"""
+
+	def __init__(
+			self,
+			min_limit: int = 1,
+			max_limit: int = 100,
+			min_timeout: int = 1,
+			max_timeout: int = 25,
+			target_latency: float = 1.0,
+			smoothing: float = 0.1
+	):
+		assert 1 <= min_limit <= max_limit <= 100, "limit must be between 1 and 100"
+		self.__min_limit: int = min_limit
+		self.__max_limit: int = max_limit
+		self.__min_timeout: int = min_timeout
+		self.__max_timeout: int = max_timeout
+		self.__target_latency: float = target_latency
+		self.__smoothing: float = smoothing
+		self.__handler_time: Optional[float] = None
+
+		self.limit: int = max_limit
+		self.timeout: int = max_timeout
+		self.backlog: int = 0
+		self.requests: int = 0
+		self.handled: int = 0
+
+	@property
+	def throughput(self) -> Optional[float]:
+		"""Estimated number of updates per second handler can process."""
+		return 1 / self.__handler_time if self.__handler_time else None
+
+	@property
+	def metrics(self) -> dict:
+		return {
+			"limit": self.limit,
+			"timeout": self.timeout,
+			"backlog": self.backlog,
+			"throughput": self.throughput,
+			"requests": self.requests,
+			"handled": self.handled,
+		}
+
+	def on_handled(self, seconds: float):
+		self.handled += 1
+		if self.__handler_time is None:
+			self.__handler_time = seconds
+		else:
+			self.__handler_time += self.__smoothing * (seconds - self.__handler_time)
+
+	def next_request(self, backlog: int) -> Tuple[int, int]:
+		"""Returns limit and timeout for the next getUpdates call."""
+		throughput = self.throughput
+		if throughput is None:
+			limit = self.__max_limit
+		else:
+			limit = int(throughput * self.__target_latency) - backlog
+		self.limit = min(self.__max_limit, max(self.__min_limit, limit))
+		self.timeout = self.__min_timeout if backlog else self.__max_timeout
+		self.backlog = backlog
+		self.requests += 1
+		return self.limit, self.timeout
+
 
 class Pooling:
-	def __init__(self, api, handler: Callable[[Update], None], update_time: float = 5, dev_mode: bool = False):
+	"""
+	Calls getUpdates in a loop and passes updates to handler.
+	With prefetch > 0 handler runs on a separate worker thread, and the next batch is requested
+	as soon as there is room for it. Up to `prefetch` batches wait in memory besides the one being handled.
+	Note: requesting the next batch confirms the previous one to Telegram, so buffered batches
+	are not redelivered if the process dies. Use stop() to drain them.
+	With `batching` set, long polling is used and batch size follows handler throughput.
+	API timeout must be longer than the long polling timeout in this case.
+	With `profiler` (HandlerProfiler) set, handler time is counted per update kind and slow updates are logged.
+	With `stats` (UpdateStats) set, update lag, backlog and dispatch latency are measured.
+	"""
+
+	def __init__(
+			self,
+			api,
+			handler: Callable[[Update], None],
+			update_time: float = 5,
+			dev_mode: bool = False,
+			prefetch: int = 0,
+			batching: Optional[AdaptiveBatching] = None,
+			profiler: Optional[Any] = None,
+			stats: Optional[Any] = None
+	):
 		self.__api: API = api
 		self.__handler: Callable[[Update], None] = handler
 		self.__update_time: float = update_time
 		self.__pooling: [Thread, None] = None
 		self.__lastUpdate: int = 0
-		self.__isRunning = False
 		self.__dev_mode = dev_mode
+		self.__prefetch: int = prefetch
+		self.__batches: Optional[Queue] = None
+		# free places in batches, taken before fetching
+		self.__slots: Optional[Semaphore] = None
+		self.__worker: Optional[Thread] = None
+		self.__batching: Optional[AdaptiveBatching] = batching
+		self.__profiler = profiler
+		self.__stats = stats
+		self.__handler_name: str = getattr(handler, "__qualname__", repr(handler))
+
+		self.__stop_event: Event = Event()
+		self.__deadline: Optional[float] = None
+		# offset sent to Telegram with the last getUpdates call, all updates below it are confirmed
+		self.__confirmed: int = 0
+		# all updates below this offset are handled
+		self.__handled: int = 0
+		self.__pending: int = 0
+		self.__lock: Lock = Lock()
+		# getUpdates long polling is running on the pooling thread
+		self.__polling: bool = False
+
+	@property
+	def batching(self) -> Optional[AdaptiveBatching]:
+		return self.__batching
+
+	@property
+	def in_flight(self) -> int:
+		"""Number of updates received from Telegram but not handled yet."""
+		return self.__pending
 
 	def start(self):
-		if self.__pooling:
+		if self.__pooling or self.__worker:
 			raise RuntimeError("Pooling already running")
 
-		self.__isRunning = True
-		self.__pooling = Thread(target=self.__request_update)
+		self.__stop_event.clear()
+		self.__deadline = None
+		if self.__prefetch:
+			self.__batches = Queue(maxsize=self.__prefetch)
+			self.__slots = Semaphore(self.__prefetch)
+			self.__worker = Thread(target=self.__process_batches, name="PoolingWorker")
+			self.__worker.start()
+		self.__pooling = Thread(target=self.__request_update, name="Pooling")
 		self.__pooling.start()
 
 		return self
 
-	def stop(self):
-		if not self.__pooling:
+	def stop(self, timeout: Optional[float] = None) -> int:
+		"""
+		Stops requesting updates and waits up to `timeout` seconds (forever if None) for handlers
+		to finish updates which are already received. Handled updates are confirmed to Telegram.
+		Returns number of updates which were still in flight.
+		"""
+		if not self.__pooling and not self.__worker:
 			raise RuntimeError("Pooling not running")
 
-		self.__isRunning = False
+		self.__deadline = None if timeout is None else monotonic() + timeout
+		self.__stop_event.set()
+		self.__interrupt_polling()
+		for thread in (self.__pooling, self.__worker):
+			if thread and thread is not current_thread():
+				thread.join(self.__time_left())
+
+		self.__commit_offset()
+		in_flight = self.__pending
+		if in_flight:
+			logging.warning(f'[Pooling] stopped with {in_flight} updates in flight')
+		return in_flight
+
+	def __interrupt_polling(self):
+		interrupt = getattr(self.__api, "interrupt", None)
+		with self.__lock:
+			if self.__polling and interrupt:
+				interrupt(self.__pooling)
+
+	def __time_left(self) -> Optional[float]:
+		return None if self.__deadline is None else max(0.0, self.__deadline - monotonic())
+
+	def __expired(self) -> bool:
+		return self.__deadline is not None and monotonic() >= self.__deadline
 
 	def __request_update(self):
 		logging.debug("[Pooling] started")
-		while self.__isRunning:
-			if self.__dev_mode:
-				self.__do_request()
-			else:
-				try:
-					self.__do_request()
-				except Exception as ex:
-					logging.error("[Pooling] got exception", exc_info=ex)
-			sleep(self.__update_time)
+		while not self.__stop_event.is_set():
+			has_updates = self.__safe_call(self.__do_request)
+			if self.__batching:
+				# long polling waits on the server side, pause only after errors
+				if has_updates is None:
+					self.__stop_event.wait(self.__update_time)
+			elif not has_updates or not self.__prefetch:
+				self.__stop_event.wait(self.__update_time)
 		self.__pooling = None
 		logging.debug("[Pooling] stopped")
 
-	def __do_request(self):
-		updates = self.__api.get_updates(offset=self.__lastUpdate)
-		for update in updates:
-			self.__lastUpdate = update.update_id + 1
+	def __safe_call(self, func, *args):
+		if self.__dev_mode:
+			return func(*args)
+		try:
+			return func(*args)
+		except Exception as ex:
+			logging.error("[Pooling] got exception", exc_info=ex)
+
+	def __do_request(self) -> bool:
+		if not self.__prefetch:
+			return self.__fetch()
+		# next getUpdates confirms the fetched batch to Telegram, so a place in the buffer is taken first:
+		# not more than `prefetch` batches are waiting for handler, and can be lost by stop(timeout)
+		if not self.__take_slot():
+			return False
+		queued = False
+		try:
+			queued = self.__fetch()
+		finally:
+			if not queued:
+				self.__slots.release()
+		return queued
+
+	def __take_slot(self) -> bool:
+		while not self.__stop_event.is_set():
+			if self.__slots.acquire(timeout=self.__update_time):
+				return True
+		return False
+
+	def __fetch(self) -> bool:
+		offset = self.__lastUpdate
+		if self.__batching:
+			limit, timeout = self.__batching.next_request(self.__pending)
+			with self.__lock:
+				if self.__stop_event.is_set():
+					return False
+				self.__polling = True
+			try:
+				updates = self.__api.get_updates(offset=offset, limit=limit, timeout=timeout)
+			except (OSError, HTTPException):
+				if self.__stop_event.is_set():
+					# interrupted by stop(), updates were not received
+					return False
+				raise
+			finally:
+				with self.__lock:
+					self.__polling = False
+		else:
+			updates = self.__api.get_updates(offset=offset)
+		self.__confirmed = offset
+		if not updates:
+			return False
+
+		received_at = monotonic()
+		self.__add_pending(len(updates))
+		if self.__prefetch:
+			self.__lastUpdate = updates[-1].update_id + 1
+			self.__batches.put_nowait((updates, received_at))
+			return True
+
+		index = 0
+		try:
+			for index, update in enumerate(updates):
+				if self.__expired():
+					break
+				self.__lastUpdate = update.update_id + 1
+				self.__call_handler(update, received_at)
+		except Exception:
+			# the rest of the batch is not confirmed and will be received again
+			self.__add_pending(index + 1 - len(updates))
+			raise
+		return True
+
+	def __add_pending(self, count: int):
+		with self.__lock:
+			self.__pending += count
+		if self.__stats:
+			self.__stats.add_backlog(count)
+
+	def __process_batches(self):
+		while not self.__expired():
+			stopping = self.__stop_event.is_set()
+			try:
+				updates, received_at = self.__batches.get(block=not stopping, timeout=self.__update_time)
+			except Empty:
+				if stopping:
+					break
+				continue
+			self.__slots.release()
+			for update in updates:
+				if self.__expired():
+					break
+				self.__safe_call(self.__call_handler, update, received_at)
+		self.__worker = None
+
+	def __call_handler(self, update: Update, received_at: float):
+		if self.__stats:
+			self.__stats.on_dispatched(update, received_at)
+		started = monotonic()
+		try:
 			self.__handler(update)
+		finally:
+			if self.__batching or self.__profiler:
+				elapsed = monotonic() - started
+				if self.__batching:
+					self.__batching.on_handled(elapsed)
+				if self.__profiler:
+					self.__profiler.observe(self.__handler_name, update, elapsed)
+			self.__add_pending(-1)
+			with self.__lock:
+				self.__handled = max(self.__handled, update.update_id + 1)
+
+	def __commit_offset(self):
+		# getUpdates with offset confirms everything below it, so handled updates are not sent again
+		if self.__handled <= self.__confirmed:
+			return
+		try:
+			self.__api.get_updates(offset=self.__handled, limit=1, timeout=0)
+			self.__confirmed = self.__handled
+		except Exception as ex:
+			logging.error("[Pooling] can't commit offset", exc_info=ex)
@@ -0,0 +1,156 @@
+import logging
+import os
+import sys
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident
+from time import monotonic
+from typing import Callable, Dict, Optional
+
+from telegram_bot_api import Update
+from telegram_bot_api.utils import get_update_kind, get_update_chat_id
+
+__all__ = ["HandlerProfiler"]
+
+
+class _Timing:
+	__slots__ = ("count", "seconds", "max", "slow")
+
+	def __init__(self):
+		self.count: int = 0
+		self.seconds: float = 0.0
+		self.max: float = 0.0
+		self.slow: int = 0
+
+	def as_dict(self) -> dict:
+		return {
+			"count": self.count,
+			"seconds": self.seconds,
+			"avg": self.seconds / self.count if self.count else 0.0,
+			"max": self.max,
+			"slow": self.slow,
+		}
+
+
+class HandlerProfiler:
+	"""
+	Times update handlers, see Pooling(profiler=...) or wrap(). Time is counted per handler and per
+	update kind, updates handled longer than `slow_threshold` seconds are logged with kind and chat id.
+
+	Sampling profiler can be switched on at runtime, for example from a signal handler:
+
+		profiler.start_sampling("handlers.folded")
+		...
+		profiler.stop_sampling()
+
+	It writes stacks of all threads in collapsed format, one line per stack with number of samples,
+	ready for flamegraph.pl or speedscope.
+	"""
+
+	def __init__(self, slow_threshold: float = 1.0, sample_interval: float = 0.005):
+		self.__slow_threshold: float = slow_threshold
+		self.__sample_interval: float = sample_interval
+		self.__handlers: Dict[str, _Timing] = {}
+		self.__kinds: Dict[str, _Timing] = {}
+		self.__lock: Lock = Lock()
+
+		self.__sampler: Optional[Thread] = None
+		self.__stop_sampling: Event = Event()
+		self.__stacks: Counter = Counter()
+		self.__path: Optional[str] = None
+
+	@property
+	def stats(self) -> dict:
+		"""{"handlers": {name: timing}, "kinds": {kind: timing}}, timing is count, seconds, avg, max and slow."""
+		with self.__lock:
+			return {
+				"handlers": {name: t.as_dict() for name, t in self.__handlers.items()},
+				"kinds": {kind: t.as_dict() for kind, t in self.__kinds.items()},
+			}
+
+	def reset(self):
+		with self.__lock:
+			self.__handlers.clear()
+			self.__kinds.clear()
+
+	def wrap(self, handler: Callable[[Update], None], name: Optional[str] = None) -> Callable[[Update], None]:
+		name = name or getattr(handler, "__qualname__", repr(handler))
+
+		def profiled_handler(update: Update):
+			started = monotonic()
+			try:
+				handler(update)
+			finally:
+				self.observe(name, update, monotonic() - started)
+
+		return profiled_handler
+
+	def observe(self, name: str, update: Update, seconds: float):
+		kind = get_update_kind(update)
+		slow = seconds >= self.__slow_threshold
+		with self.__lock:
+			for timings, key in ((self.__handlers, name), (self.__kinds, kind)):
+				timing = timings.get(key)
+				if timing is None:
+					timing = timings[key] = _Timing()
+				timing.count += 1
+				timing.seconds += seconds
+				timing.max = max(timing.max, seconds)
+				timing.slow += slow
+		if slow:
+			logging.warning(
+				f'[HandlerProfiler] slow update {update.update_id}: {seconds:.3f}s in {name}, '
+				f'kind {kind}, chat {get_update_chat_id(update)}'
+			)
+
+	@property
+	def sampling(self) -> bool:
+		return self.__sampler is not None
+
+	def start_sampling(self, path: str):
+		"""Starts collecting stacks, they are written to `path` by stop_sampling()."""
+		if self.__sampler:
+			return
+		self.__path = path
+		self.__stacks = Counter()
+		self.__stop_sampling.clear()
+		self.__sampler = Thread(target=self.__sample, name="HandlerProfiler", daemon=True)
+		self.__sampler.start()
+		logging.info("[HandlerProfiler] sampling started")
+
+	def stop_sampling(self) -> Optional[str]:
+		"""Stops sampling and writes collected stacks, returns path of the file."""
+		if not self.__sampler:
+			return None
+		self.__stop_sampling.set()
+		self.__sampler.join()
+		self.__sampler = None
+
+		tmp = f'{self.__path}.tmp'
+		with open(tmp, "w") as f:
+			for stack, count in self.__stacks.most_common():
+				f.write(f'{stack} {count}\n')
+		os.replace(tmp, self.__path)
+		logging.info(f'[HandlerProfiler] {sum(self.__stacks.values())} samples written to {self.__path}')
+		return self.__path
+
+	def toggle_sampling(self, path: str) -> bool:
+		"""Starts or stops sampling, returns True if sampling is on now."""
+		if self.__sampler:
+			self.stop_sampling()
+			return False
+		self.start_sampling(path)
+		return True
+
+	def __sample(self):
+		own = get_ident()
+		stacks = self.__stacks
+		while not self.__stop_sampling.wait(self.__sample_interval):
+			for thread_id, frame in sys._current_frames().items():
+				if thread_id == own:
+					continue
+				names = []
+				while frame is not None:
+					code = frame.f_code
+					names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+					frame = frame.f_back
+				stacks[";".join(reversed(names))] += 1
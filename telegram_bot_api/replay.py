@@ -0,0 +1,325 @@
+import glob
+import gzip
+import json
+import os
+import random
+import time
+import zlib
+from collections import deque
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from telegram_bot_api import ApiCall, ApiHook, Update
+from telegram_bot_api.pooling import Pooling
+
+__all__ = [
+	"Record",
+	"UpdateRecorder",
+	"read_records",
+	"SYNTHETIC_MIX",
+	"synthetic_update",
+	"synthetic_records",
+	"ReplayReport",
+	"ReplayAPI",
+	"Replayer",
+]
+
+# (time.time() when update was received, update as received from Bot API)
+Record = Tuple[float, dict]
+
+
+class UpdateRecorder(ApiHook):
+	"""
+	Writes received updates to gzip compressed JSON lines files in `directory`, new file is started
+	after `segment_size` updates.
+	Every line is {"t": receive time, "update": update as received}. Use it as API hook to record
+	getUpdates responses, or call record() from webhook handler with the parsed request body:
+
+		api = API(token, hooks=[UpdateRecorder("recorded")])
+	"""
+
+	def __init__(self, directory: str, segment_size: int = 10000):
+		self.__directory: str = directory
+		self.__segment_size: int = segment_size
+		self.__file: Optional[gzip.GzipFile] = None
+		self.__written: int = 0
+		self.__lock: Lock = Lock()
+		self.recorded: int = 0
+		os.makedirs(directory, exist_ok=True)
+
+	def after_response(self, call: ApiCall, data: bytes) -> bytes:
+		if call.api_method == "getUpdates":
+			result = json.loads(data).get("result")
+			if result:
+				self.record(result)
+		return data
+
+	def record(self, updates: List[dict]):
+		now = time.time()
+		lines = "".join(json.dumps({"t": now, "update": u}, separators=(",", ":")) + "\n" for u in updates)
+		with self.__lock:
+			if self.__file is None:
+				name = f'updates-{int(now * 1000)}.jsonl.gz'
+				self.__file = gzip.open(os.path.join(self.__directory, name), "wt", encoding="utf-8")
+			self.__file.write(lines)
+			# sync flush: updates are readable even if the process dies before the segment is closed
+			self.__file.flush()
+			self.__written += len(updates)
+			self.recorded += len(updates)
+			if self.__written >= self.__segment_size:
+				self.__close()
+
+	def close(self):
+		with self.__lock:
+			self.__close()
+
+	def __close(self):
+		if self.__file:
+			self.__file.close()
+			self.__file = None
+			self.__written = 0
+
+
+def read_records(directory: str) -> Iterator[Record]:
+	"""Reads segments written by UpdateRecorder, oldest first."""
+	for path in sorted(glob.glob(os.path.join(directory, "updates-*.jsonl.gz"))):
+		with gzip.open(path, "rt", encoding="utf-8") as f:
+			# segment which was not closed ends without gzip trailer, and its last line can be cut
+			try:
+				for line in f:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						break
+					yield record["t"], record["update"]
+			except (EOFError, zlib.error):
+				pass
+
+
+# kinds of synthetic updates and their default share
+SYNTHETIC_MIX = {
+	"text": 0.6,
+	"photo": 0.1,
+	"edited_message": 0.05,
+	"channel_post": 0.05,
+	"callback_query": 0.15,
+	"inline_query": 0.05,
+}
+
+_USER = {"id": 123456789, "is_bot": False, "first_name": "Alice", "username": "alice", "language_code": "en"}
+_CHANNEL = {"id": -1001234567890, "type": "channel", "title": "News"}
+
+
+def _message(update_id: int, chat_id: int, **fields) -> dict:
+	user = dict(_USER, id=chat_id)
+	chat = {"id": chat_id, "type": "private", "first_name": user["first_name"], "username": user["username"]}
+	message = {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": user}
+	message.update(fields)
+	return message
+
+
+def synthetic_update(kind: str, update_id: int, chat_id: int = _USER["id"]) -> dict:
+	"""Returns update of `kind` (see SYNTHETIC_MIX) as received from Bot API."""
+	if kind == "text":
+		return {"update_id": update_id, "message": _message(
+			update_id, chat_id,
+			text="/start hello @someone, see https://example.com #tag",
+			entities=[
+				{"type": "bot_command", "offset": 0, "length": 6},
+				{"type": "mention", "offset": 13, "length": 8},
+				{"type": "url", "offset": 27, "length": 19},
+				{"type": "hashtag", "offset": 47, "length": 4},
+			]
+		)}
+	if kind == "photo":
+		sizes = [
+			{"file_id": f'AgACAgIAAxkBAAI{update_id}{w}', "file_unique_id": f'AQAD{update_id}{w}',
+			 "width": w, "height": w * 3 // 4, "file_size": w * 100}
+			for w in (90, 320, 800, 1280)
+		]
+		return {"update_id": update_id, "message": _message(update_id, chat_id, photo=sizes, caption="photo #tag")}
+	if kind == "edited_message":
+		message = _message(update_id, chat_id, text="edited text", edit_date=int(time.time()))
+		return {"update_id": update_id, "edited_message": message}
+	if kind == "channel_post":
+		message = _message(update_id, chat_id, text="channel post", chat=_CHANNEL, sender_chat=_CHANNEL)
+		del message["from"]
+		return {"update_id": update_id, "channel_post": message}
+	if kind == "callback_query":
+		return {"update_id": update_id, "callback_query": {
+			"id": str(update_id), "from": dict(_USER, id=chat_id), "chat_instance": "-123456",
+			"message": _message(update_id, chat_id, text="menu", reply_markup={"inline_keyboard": [
+				[{"text": "Yes", "callback_data": "yes"}, {"text": "No", "callback_data": "no"}]
+			]}),
+			"data": "yes",
+		}}
+	if kind == "inline_query":
+		return {"update_id": update_id, "inline_query": {
+			"id": str(update_id), "from": dict(_USER, id=chat_id), "query": "cats", "offset": "",
+		}}
+	raise ValueError(f'unknown kind {kind}')
+
+
+def synthetic_records(
+		count: int,
+		mix: Optional[Dict[str, float]] = None,
+		rate: Optional[float] = None,
+		chats: int = 1000,
+		seed: Optional[int] = None
+) -> Iterator[Record]:
+	"""
+	Generates `count` updates, kinds are chosen by weights in `mix`, senders among `chats` users.
+	Updates come `rate` per second with exponential intervals, all at once if rate is None.
+	"""
+	rnd = random.Random(seed)
+	mix = mix or SYNTHETIC_MIX
+	kinds = list(mix)
+	weights = [mix[k] for k in kinds]
+	t = 0.0
+	for update_id in range(1, count + 1):
+		if rate:
+			t += rnd.expovariate(rate)
+		kind = rnd.choices(kinds, weights)[0]
+		yield t, synthetic_update(kind, update_id, chat_id=rnd.randrange(chats) + 1)
+
+
+class ReplayReport:
+	def __init__(self, latencies: List[float], seconds: float):
+		latencies = sorted(latencies)
+		self.count: int = len(latencies)
+		self.seconds: float = seconds
+		self.rate: float = self.count / seconds if seconds > 0 else 0.0
+		self.p50: float = self.percentile(latencies, 0.5)
+		self.p90: float = self.percentile(latencies, 0.9)
+		self.p99: float = self.percentile(latencies, 0.99)
+		self.max: float = latencies[-1] if latencies else 0.0
+
+	@staticmethod
+	def percentile(ordered: List[float], q: float) -> float:
+		if not ordered:
+			return 0.0
+		return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+	def __repr__(self):
+		return (
+			f'[{self.__class__.__name__}]: {self.count} updates in {self.seconds:.2f}s, {self.rate:.0f} updates/s, '
+			f'latency p50 {self.p50 * 1000:.1f}ms, p90 {self.p90 * 1000:.1f}ms, '
+			f'p99 {self.p99 * 1000:.1f}ms, max {self.max * 1000:.1f}ms'
+		)
+
+
+class ReplayAPI:
+	"""
+	Serves recorded updates to Pooling through get_updates(), keeping their original timing
+	divided by `speed`, or as fast as they are taken if speed is None.
+	Updates are renumbered, so offsets work for records from any number of sources.
+	"""
+
+	def __init__(self, records: Iterable[Record], speed: Optional[float] = 1.0):
+		self.__records: Iterator[Record] = iter(records)
+		self.__speed: Optional[float] = speed
+		self.__next: Optional[Record] = None
+		self.__first_t: Optional[float] = None
+		self.__started: float = monotonic()
+		self.__next_id: int = 1
+		# delivered, but not confirmed yet
+		self.__unconfirmed: Deque[dict] = deque()
+		self.__condition: Condition = Condition()
+		# update_id -> monotonic() time when it was available for the bot
+		self.arrived: Dict[int, float] = {}
+		self.exhausted: bool = False
+
+	def start(self):
+		self.__started = monotonic()
+
+	def get_updates(self, offset=None, limit=None, timeout=None, allowed_updates=None) -> List[Update]:
+		limit = limit or 100
+		deadline = monotonic() + (timeout or 0)
+		with self.__condition:
+			while self.__unconfirmed and offset and self.__unconfirmed[0]["update_id"] < offset:
+				self.__unconfirmed.popleft()
+			if self.__unconfirmed:
+				return [Update(**d) for d in list(self.__unconfirmed)[:limit]]
+
+			batch = []
+			while len(batch) < limit:
+				due = self.__due()
+				if due is None:
+					break
+				now = monotonic()
+				if due > now:
+					if batch or now >= deadline:
+						break
+					self.__condition.wait(min(due, deadline) - now)
+					continue
+				t, data = self.__next
+				self.__next = None
+				data = dict(data, update_id=self.__next_id)
+				self.__next_id += 1
+				self.arrived[data["update_id"]] = max(due, now) if self.__speed else now
+				batch.append(data)
+			self.__unconfirmed.extend(batch)
+			return [Update(**d) for d in batch]
+
+	def __due(self) -> Optional[float]:
+		if self.__next is None:
+			self.__next = next(self.__records, None)
+			if self.__next is None:
+				self.exhausted = True
+				return None
+		t = self.__next[0]
+		if not self.__speed:
+			return self.__started
+		if self.__first_t is None:
+			self.__first_t = t
+		return self.__started + (t - self.__first_t) / self.__speed
+
+
+class Replayer:
+	"""
+	Feeds recorded or synthetic updates to a handler and measures sustained updates/sec
+	and latency from update arrival to the end of its handling:
+
+		report = Replayer(read_records("recorded"), speed=10).run(handler, prefetch=2)
+
+	speed 1 keeps original timing, 10 is ten times faster, None is as fast as handler goes.
+	Updates go through Pooling, created with `pooling_params`, or straight to handler with pooling=False.
+	"""
+
+	def __init__(self, records: Iterable[Record], speed: Optional[float] = None):
+		self.__api: ReplayAPI = ReplayAPI(records, speed)
+		self.__latencies: List[float] = []
+		self.__lock: Lock = Lock()
+
+	def run(self, handler: Callable[[Update], None], pooling: bool = True, **pooling_params) -> ReplayReport:
+		api = self.__api
+
+		def measured_handler(update: Update):
+			try:
+				handler(update)
+			finally:
+				latency = monotonic() - api.arrived.pop(update.update_id)
+				with self.__lock:
+					self.__latencies.append(latency)
+
+		api.start()
+		started = monotonic()
+		if pooling:
+			pooling_params.setdefault("update_time", 0.001)
+			worker = Pooling(api, measured_handler, **pooling_params).start()
+			while not api.exhausted or worker.in_flight or api.arrived:
+				time.sleep(0.01)
+			worker.stop()
+		else:
+			offset = None
+			while True:
+				updates = api.get_updates(offset=offset, timeout=1)
+				if not updates:
+					if api.exhausted:
+						break
+					continue
+				for update in updates:
+					measured_handler(update)
+				offset = updates[-1].update_id + 1
+		return ReplayReport(self.__latencies, monotonic() - started)
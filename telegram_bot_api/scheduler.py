@@ -0,0 +1,145 @@
+from collections import deque
+from contextlib import contextmanager
+from enum import Enum
+from threading import Condition, local
+from time import monotonic
+from typing import Deque, Dict, Optional, Set
+
+__all__ = [
+	"Priority",
+	"INTERACTIVE_METHODS",
+	"EXEMPT_METHODS",
+	"request_priority",
+	"get_request_priority",
+	"RequestScheduler",
+]
+
+
+class Priority(Enum):
+	INTERACTIVE = 0
+	NORMAL = 1
+	BULK = 2
+
+
+# user is waiting for these answers right now
+INTERACTIVE_METHODS = {"answerCallbackQuery", "answerInlineQuery", "answerPreCheckoutQuery", "answerShippingQuery"}
+# not limited by Telegram, long polling must not hold rate budget
+EXEMPT_METHODS = {"getUpdates"}
+
+_context = local()
+
+
+@contextmanager
+def request_priority(priority: Priority):
+	"""All API calls made by this thread inside the block use given priority."""
+	previous = getattr(_context, "priority", None)
+	_context.priority = priority
+	try:
+		yield
+	finally:
+		_context.priority = previous
+
+
+def get_request_priority() -> Optional[Priority]:
+	return getattr(_context, "priority", None)
+
+
+class _Ticket:
+	__slots__ = ("granted",)
+
+	def __init__(self):
+		self.granted: bool = False
+
+
+class RequestScheduler:
+	"""
+	Orders outgoing API calls when the bot sends faster than `rate` calls per second.
+	Interactive calls own `interactive_share` of the rate and can use the rest too.
+	The shared part is split between waiting classes by weight, so bulk calls always progress.
+	Priority comes from request_priority() block, INTERACTIVE_METHODS, or is NORMAL.
+	"""
+
+	def __init__(
+			self,
+			rate: float = 30.0,
+			interactive_share: float = 0.2,
+			weights: Optional[Dict[Priority, int]] = None,
+			exempt: Set[str] = frozenset(EXEMPT_METHODS)
+	):
+		assert 0 <= interactive_share < 1, "interactive_share must be in [0, 1)"
+		self.__reserved_rate: float = rate * interactive_share
+		self.__shared_rate: float = rate - self.__reserved_rate
+		self.__weights: Dict[Priority, int] = weights or {Priority.INTERACTIVE: 6, Priority.NORMAL: 3, Priority.BULK: 1}
+		self.__exempt: Set[str] = exempt
+
+		# buckets hold up to one second of tokens
+		self.__reserved: float = self.__reserved_rate
+		self.__shared: float = self.__shared_rate
+		self.__updated: float = monotonic()
+		self.__queues: Dict[Priority, Deque[_Ticket]] = {p: deque() for p in Priority}
+		# smooth weighted round robin state
+		self.__current: Dict[Priority, int] = {p: 0 for p in Priority}
+		self.__cond: Condition = Condition()
+
+	def waiting(self, priority: Priority) -> int:
+		return len(self.__queues[priority])
+
+	def acquire(self, api_method: str):
+		"""Blocks until the call may be sent."""
+		if api_method in self.__exempt:
+			return
+		priority = get_request_priority()
+		if priority is None:
+			priority = Priority.INTERACTIVE if api_method in INTERACTIVE_METHODS else Priority.NORMAL
+
+		ticket = _Ticket()
+		with self.__cond:
+			self.__queues[priority].append(ticket)
+			while True:
+				self.__dispatch()
+				if ticket.granted:
+					return
+				self.__cond.wait(self.__next_token_in())
+
+	def __refill(self):
+		now = monotonic()
+		elapsed = now - self.__updated
+		self.__updated = now
+		self.__reserved = min(max(1.0, self.__reserved_rate), self.__reserved + elapsed * self.__reserved_rate)
+		self.__shared = min(max(1.0, self.__shared_rate), self.__shared + elapsed * self.__shared_rate)
+
+	def __dispatch(self):
+		self.__refill()
+		granted = False
+		interactive = self.__queues[Priority.INTERACTIVE]
+		while interactive and self.__reserved >= 1:
+			interactive.popleft().granted = True
+			self.__reserved -= 1
+			granted = True
+		while self.__shared >= 1:
+			priority = self.__pick()
+			if priority is None:
+				break
+			self.__queues[priority].popleft().granted = True
+			self.__shared -= 1
+			granted = True
+		if granted:
+			self.__cond.notify_all()
+
+	def __pick(self) -> Optional[Priority]:
+		waiting = [p for p in Priority if self.__queues[p]]
+		if not waiting:
+			return None
+		total = 0
+		for p in waiting:
+			self.__current[p] += self.__weights[p]
+			total += self.__weights[p]
+		best = max(waiting, key=lambda p: self.__current[p])
+		self.__current[best] -= total
+		return best
+
+	def __next_token_in(self) -> float:
+		wait = (1 - self.__shared) / self.__shared_rate if self.__shared_rate else 1.0
+		if self.__queues[Priority.INTERACTIVE] and self.__reserved_rate:
+			wait = min(wait, (1 - self.__reserved) / self.__reserved_rate)
+		return max(0.001, wait)
@@ -0,0 +1,92 @@
+import logging
+from math import ceil
+from threading import Thread, Lock, Event, current_thread
+from time import monotonic
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+__all__ = ["TimerWheel"]
+
+
+class TimerWheel:
+	"""
+	Hashed timer wheel: one thread serves any number of keyed timers.
+	Scheduling, rescheduling and cancelling are O(1), precision is one tick.
+	Callbacks run on the wheel thread, so they should be short.
+	"""
+
+	def __init__(self, tick: float = 0.05, slots: int = 256):
+		assert tick > 0 and slots > 0, "tick and slots must be positive"
+		self.__tick: float = tick
+		# slot holds key -> (rounds left, callback)
+		self.__slots: List[Dict[Hashable, Tuple[int, Callable[[], None]]]] = [{} for _ in range(slots)]
+		self.__timers: Dict[Hashable, int] = {}
+		self.__cursor: int = 0
+		self.__lock: Lock = Lock()
+		self.__stop_event: Event = Event()
+		self.__thread: Optional[Thread] = None
+
+	def __len__(self):
+		return len(self.__timers)
+
+	def __contains__(self, key: Hashable):
+		return key in self.__timers
+
+	def schedule(self, key: Hashable, delay: float, callback: Callable[[], None]):
+		"""Runs callback after delay seconds. Existing timer with the same key is replaced."""
+		ticks = max(1, ceil(delay / self.__tick))
+		size = len(self.__slots)
+		with self.__lock:
+			self.__cancel(key)
+			index = (self.__cursor + ticks) % size
+			self.__slots[index][key] = ((ticks - 1) // size, callback)
+			self.__timers[key] = index
+			if not self.__thread:
+				self.__stop_event = Event()
+				self.__thread = Thread(target=self.__run, args=(self.__stop_event,), name="TimerWheel", daemon=True)
+				self.__thread.start()
+
+	def cancel(self, key: Hashable) -> bool:
+		with self.__lock:
+			return self.__cancel(key)
+
+	def stop(self, timeout: Optional[float] = None):
+		"""Stops the wheel thread. Pending timers are dropped."""
+		with self.__lock:
+			thread, self.__thread = self.__thread, None
+			for slot in self.__slots:
+				slot.clear()
+			self.__timers.clear()
+			self.__stop_event.set()
+		if thread and thread is not current_thread():
+			thread.join(timeout)
+
+	def __cancel(self, key: Hashable) -> bool:
+		index = self.__timers.pop(key, None)
+		if index is None:
+			return False
+		del self.__slots[index][key]
+		return True
+
+	def __run(self, stop_event: Event):
+		next_tick = monotonic() + self.__tick
+		while not stop_event.wait(max(0.0, next_tick - monotonic())):
+			next_tick += self.__tick
+			for callback in self.__advance():
+				try:
+					callback()
+				except Exception as ex:
+					logging.error("[TimerWheel] callback failed", exc_info=ex)
+
+	def __advance(self) -> List[Callable[[], None]]:
+		due = []
+		with self.__lock:
+			self.__cursor = (self.__cursor + 1) % len(self.__slots)
+			slot = self.__slots[self.__cursor]
+			for key, (rounds, callback) in list(slot.items()):
+				if rounds:
+					slot[key] = (rounds - 1, callback)
+					continue
+				del slot[key]
+				del self.__timers[key]
+				due.append(callback)
+		return due
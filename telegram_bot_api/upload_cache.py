@@ -0,0 +1,87 @@
+import hashlib
+import os
+from threading import Lock
+from typing import Optional
+
+from telegram_bot_api import InputFile
+
+__all__ = ["UploadCache"]
+
+_CHUNK_SIZE = 1 << 20
+
+
+class UploadCache:
+	"""
+	Remembers file_id which Telegram returned for uploaded file, see API(upload_cache=...).
+	Files are identified by sha256 of their content. Path, mtime and size are checked first,
+	so an unchanged file is hashed only once. file_id is stored per field: photo file_id can't be sent as document.
+	Mapping is kept in sqlite database at `path`, use ":memory:" to keep it for this process only.
+	"""
+
+	def __init__(self, path: str = ":memory:"):
+		# imported here: sqlite3 is optional in some Python builds, and the package must import without it
+		import sqlite3
+		self.__db: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+		self.__lock: Lock = Lock()
+		with self.__lock, self.__db:
+			self.__db.execute(
+				"CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, digest TEXT)"
+			)
+			self.__db.execute(
+				"CREATE TABLE IF NOT EXISTS file_ids (digest TEXT, field TEXT, file_id TEXT, PRIMARY KEY (digest, field))"
+			)
+
+	def lookup(self, input_file: InputFile, field: str) -> Optional[str]:
+		digest = self.digest(input_file)
+		if not digest:
+			return None
+		with self.__lock:
+			row = self.__db.execute(
+				"SELECT file_id FROM file_ids WHERE digest = ? AND field = ?", (digest, field)
+			).fetchone()
+		return row[0] if row else None
+
+	def store(self, input_file: InputFile, field: str, file_id: str):
+		digest = self.digest(input_file)
+		if not digest:
+			return
+		with self.__lock, self.__db:
+			self.__db.execute("INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?)", (digest, field, file_id))
+
+	def forget(self, file_id: str):
+		with self.__lock, self.__db:
+			self.__db.execute("DELETE FROM file_ids WHERE file_id = ?", (file_id,))
+
+	def digest(self, input_file: InputFile) -> Optional[str]:
+		"""Content hash of a file or bytes, None for file objects and chunks: they can be read only once."""
+		value = input_file.value
+		if isinstance(value, (bytes, bytearray, memoryview)):
+			return hashlib.sha256(value).hexdigest()
+		if not isinstance(value, str):
+			return None
+
+		path = os.path.abspath(value)
+		try:
+			st = os.stat(path)
+		except OSError:
+			return None
+
+		with self.__lock:
+			row = self.__db.execute(
+				"SELECT digest FROM files WHERE path = ? AND mtime = ? AND size = ?", (path, st.st_mtime_ns, st.st_size)
+			).fetchone()
+		if row:
+			return row[0]
+
+		sha = hashlib.sha256()
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+				sha.update(chunk)
+		digest = sha.hexdigest()
+		with self.__lock, self.__db:
+			self.__db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, st.st_mtime_ns, st.st_size, digest))
+		return digest
+
+	def close(self):
+		with self.__lock:
+			self.__db.close()
@@ -1,27 +1,153 @@
+import re
+from bisect import bisect_left
+from copy import copy
 from io import StringIO
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Union
 
-from telegram_bot_api import MessageEntityType, Message, MessageEntity, User
+from telegram_bot_api import API, MessageEntityType, Message, MessageEntity, User, Update
+
+__all__ = [
+	"MESSAGE_LIMIT",
+	"UPDATE_KINDS",
+	"utf16_length",
+	"Utf16Index",
+	"get_value",
+	"get_values",
+	"get_entities",
+	"get_entities_by_type",
+	"get_update_kind",
+	"get_update_chat_id",
+	"MessageBuilder",
+]
+
+# https://core.telegram.org/bots/api#sendmessage
+# text of the message to be sent, 1-4096 characters after entities parsing
+MESSAGE_LIMIT = 4096
+
+# https://core.telegram.org/bots/api#update
+# at most one of these fields is present in any given update
+UPDATE_KINDS = (
+	"message",
+	"edited_message",
+	"channel_post",
+	"edited_channel_post",
+	"inline_query",
+	"chosen_inline_result",
+	"callback_query",
+	"shipping_query",
+	"pre_checkout_query",
+	"poll",
+	"poll_answer",
+)
+
+
+# characters outside of Basic Multilingual Plane take two UTF-16 code units
+_ASTRAL = re.compile("[\U00010000-\U0010ffff]")
+_HAS_ISASCII = hasattr(str, "isascii")
+
+
+def _bmp_only(text: str) -> bool:
+	# isascii() is O(1), it is available since python 3.7
+	return (_HAS_ISASCII and text.isascii()) or not _ASTRAL.search(text)
+
+
+def utf16_length(text: str) -> int:
+	return len(text.encode("utf-16-le")) // 2
+
+
+class Utf16Index:
+	"""
+	Maps UTF-16 offsets, which Telegram uses in MessageEntity, to indexes of python str.
+	Built once per text in O(n), every lookup is O(log k) for k characters outside of BMP
+	and O(1) for BMP only text, which is the most common case.
+	"""
+
+	__slots__ = ("text", "__astral")
+
+	def __init__(self, text: str):
+		self.text: str = text
+		# UTF-16 offsets of characters taking two code units, empty for BMP only text
+		self.__astral: List[int] = []
+		if not _bmp_only(text):
+			self.__astral = [m.start() + i for i, m in enumerate(_ASTRAL.finditer(text))]
+
+	def index(self, offset: int) -> int:
+		if not self.__astral:
+			return offset
+		return offset - bisect_left(self.__astral, offset)
+
+	def get_value(self, entity: MessageEntity) -> str:
+		return self.text[self.index(entity.offset):self.index(entity.offset + entity.length)]
 
 
 def get_value(entity: MessageEntity, text: str) -> str:
-	return text[entity.offset:entity.offset + entity.length]
+	"""Builds offset index for every call, use get_values() for several entities of one text."""
+	return Utf16Index(text).get_value(entity)
+
+
+def get_values(text: str, entities: List[MessageEntity]) -> Tuple[str]:
+	if not entities:
+		return tuple()
+	index = Utf16Index(text)
+	return tuple(index.get_value(e) for e in entities)
 
 
 def get_entities(text: str, entities: List[MessageEntity], entity_type: MessageEntityType) -> Tuple[str]:
-	return tuple(get_value(e, text) for e in entities if e.type == entity_type) if entities else tuple()
+	if not text or not entities:
+		return tuple()
+	if _bmp_only(text):
+		# UTF-16 offsets are the same as str indexes
+		return tuple(text[e.offset:e.offset + e.length] for e in entities if e.type == entity_type)
+	index = Utf16Index(text)
+	return tuple(index.get_value(e) for e in entities if e.type == entity_type)
 
 
 def get_entities_by_type(message: Message, entity_type: MessageEntityType) -> Tuple[str]:
+	"""Entities of message text and caption."""
 	if not message:
 		return tuple()
-	return get_entities(message.text, message.entities, entity_type)
+	result = get_entities(message.text, message.entities, entity_type)
+	if message.caption_entities:
+		result += get_entities(message.caption, message.caption_entities, entity_type)
+	return result
+
+
+def get_update_kind(update: Update) -> str:
+	for kind in UPDATE_KINDS:
+		if getattr(update, kind, None) is not None:
+			return kind
+	return "unknown"
+
+
+def get_update_chat_id(update: Update) -> Optional[int]:
+	message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+	if not message and update.callback_query:
+		message = update.callback_query.message
+	return message.chat.id if message else None
 
 
 class MessageBuilder:
+	"""
+	Builds message text with entities, offsets are counted in UTF-16 code units as Telegram expects.
+	Long text is split into messages of at most `MESSAGE_LIMIT` characters by split() or send().
+	"""
+
 	def __init__(self):
 		self.__text: StringIO = StringIO()
 		self.__entities: List[MessageEntity] = []
+		# str index range of every entity, for split()
+		self.__ranges: List[Tuple[int, int]] = []
+		# str indexes of characters outside of BMP, they take two UTF-16 code units
+		self.__astral: List[int] = []
+		self.__length: int = 0
+		self.__utf16_length: int = 0
+
+	def __write(self, text: str):
+		if not _bmp_only(text):
+			self.__astral.extend(self.__length + m.start() for m in _ASTRAL.finditer(text))
+		self.__text.write(text)
+		self.__length += len(text)
+		self.__utf16_length += utf16_length(text)
 
 	def append(
 			self,
@@ -32,11 +158,13 @@ class MessageBuilder:
 			language: Optional[str] = None
 	):
 		if entity_type == MessageEntityType.WRONG:
-			self.__text.write(text)
+			self.__write(text)
 			return self
-		offset = self.__text.tell()
+		offset = self.__utf16_length
+		start = self.__length
 		entity_text = f'{self.get_prefix(entity_type)}{text}'
-		entity = MessageEntity(type=entity_type, offset=offset, length=len(entity_text))
+		self.__write(entity_text)
+		entity = MessageEntity(type=entity_type, offset=offset, length=self.__utf16_length - offset)
 		if url:
 			assert entity_type == MessageEntityType.TEXT_LINK, "url allowed for 'text_link' only"
 			entity.url = url
@@ -46,8 +174,8 @@ class MessageBuilder:
 		if language:
 			assert entity_type == MessageEntityType.PRE, "language allowed for 'pre' only"
 			entity.language = language
-		self.__text.write(entity_text)
 		self.__entities.append(entity)
+		self.__ranges.append((start, self.__length))
 		return self
 
 	@staticmethod
@@ -66,3 +194,92 @@ class MessageBuilder:
 
 	def get(self) -> Tuple[str, List[MessageEntity]]:
 		return self.__text.getvalue(), self.__entities
+
+	def split(self, limit: int = MESSAGE_LIMIT) -> List[Tuple[str, List[MessageEntity]]]:
+		"""
+		Splits text into messages of at most `limit` UTF-16 code units. Messages end at the last line break
+		which fits, or at entity boundary, or at the limit. Entities crossing the split are cut,
+		offsets are counted from the start of every message. Every character and entity is visited once.
+		"""
+		text = self.__text.getvalue()
+		if self.__utf16_length <= limit:
+			return [(text, self.__entities)] if text.strip() else []
+
+		# boundaries of all entities, sorted because entities do not overlap
+		boundaries = [i for r in self.__ranges for i in r]
+		chunks = []
+		entity = 0
+		start = 0
+		while start < len(text):
+			end = self.__index(self.__utf16(start) + limit)
+			if end < len(text):
+				line = text.rfind("\n", start, end)
+				if line >= start:
+					end = line + 1
+				else:
+					boundary = bisect_left(boundaries, end + 1) - 1
+					# entity starting there would be cut anyway when it does not fit into one message
+					too_long = boundary % 2 == 0 and self.__entities[boundary // 2].length > limit
+					if boundary >= 0 and boundaries[boundary] > start and not too_long:
+						end = boundaries[boundary]
+			end = max(end, start + 1)
+
+			base = self.__utf16(start)
+			entities = []
+			while entity < len(self.__ranges) and self.__ranges[entity][0] < end:
+				first, last = self.__ranges[entity]
+				first, last = max(first, start), min(last, end)
+				if first < last:
+					part = copy(self.__entities[entity])
+					part.offset = self.__utf16(first) - base
+					part.length = self.__utf16(last) - self.__utf16(first)
+					entities.append(part)
+				if self.__ranges[entity][1] > end:
+					# continues in the next message
+					break
+				entity += 1
+
+			chunk = text[start:end]
+			if chunk.strip():
+				chunks.append((chunk, entities))
+			start = end
+		return chunks
+
+	def send(self, api: API, chat_id: Union[int, str], limit: int = MESSAGE_LIMIT, **params) -> List[Message]:
+		"""
+		Sends split() messages in order, params are passed to send_message.
+		reply_to_message_id is used for the first message and reply_markup for the last one.
+		"""
+		reply_to_message_id = params.pop("reply_to_message_id", None)
+		reply_markup = params.pop("reply_markup", None)
+		chunks = self.split(limit)
+		messages = []
+		for i, (text, entities) in enumerate(chunks):
+			messages.append(api.send_message(
+				chat_id, text,
+				entities=entities or None,
+				reply_to_message_id=reply_to_message_id if i == 0 else None,
+				reply_markup=reply_markup if i == len(chunks) - 1 else None,
+				**params
+			))
+		return messages
+
+	def __utf16(self, index: int) -> int:
+		"""UTF-16 offset of str index."""
+		return index + bisect_left(self.__astral, index) if self.__astral else index
+
+	def __index(self, offset: int) -> int:
+		"""The largest str index with UTF-16 offset not above `offset`."""
+		if not self.__astral:
+			return min(offset, self.__length)
+		if offset >= self.__utf16_length:
+			return self.__length
+		# every character before index takes one unit, plus one more for each astral one
+		low, high = max(0, offset - len(self.__astral)), min(offset, self.__length)
+		while low < high:
+			middle = (low + high + 1) // 2
+			if self.__utf16(middle) <= offset:
+				low = middle
+			else:
+				high = middle - 1
+		return low